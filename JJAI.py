@@ -1,47 +1,130 @@
+import time
+BOOT_STARTED = time.perf_counter()  # Measures worker startup, keep first
+
+import os
+import json
+import hashlib
 import dash
-from dash import dcc, html
+import flask
+from dash import dcc, html, dash_table
 import dash.dependencies as dd
-import yfinance as yf
+from dash.exceptions import PreventUpdate
+import pandas as pd
 import plotly.graph_objects as go
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, wait
 import pytz
 
+from chains import ChainSnapshot, expirations_within, fetch_chains, snap_expiration
+from downsample import MAX_POINTS, downsample
+from levels import compute_levels
+import metrics
+from metrics import span, timed
+from api import cached_response, compress_variants, precompressed_response, to_jsonable
+from bars import RETENTION_DAYS, PartialHistory
+from cache import TTLS, bar_aligned_ttl, make_cache
+from governor import UpstreamUnavailable
+from providers import make_provider
+from scanner import ScanJob, parse_tickers, run_scan, scan_progress, throughput
+from scheduler import start_prefetch, watchlist
+
 # Initialize Dash app
 app = dash.Dash(__name__)
 server = app.server  # For deployment
 
-# Function to fetch stock and options data
-def fetch_data(ticker, expiration_date, start_time, end_time):
-    stock = yf.Ticker(ticker)
-    
+# Market data source (live Yahoo by default, see providers.make_provider)
+provider = make_provider()
+
+# Hit/miss counters of the cache shared by all workers
+@server.route('/cache/stats')
+def cache_stats():
+    cache = getattr(provider, 'cache', None)
+    return flask.jsonify(cache.stats() if cache else {})
+
+# Time every HTTP request by route; for Dash callbacks this includes
+# serializing the figure, on top of the callback's own stages
+@server.before_request
+def start_request_timer():
+    flask.g.request_started = time.perf_counter()
+
+@server.after_request
+def stop_request_timer(response):
+    started = getattr(flask.g, 'request_started', None)
+    if started is not None:
+        route = flask.request.url_rule.rule if flask.request.url_rule else 'unmatched'
+        metrics.observe(f"http {route}", time.perf_counter() - started)
+    return response
+
+# Per-stage latency histograms of this worker in Prometheus text format
+@server.route('/metrics')
+def metrics_endpoint():
+    gauges = [('jjai_startup_seconds', {}, STARTUP_SECONDS)]
+    counters = []
+    cache = getattr(provider, 'cache', None)
+    if cache is not None:
+        stats = cache.stats()
+        for kind, totals in stats['counters'].items():
+            counters.append(('jjai_cache_hits_total', {'kind': kind}, totals['hits']))
+            counters.append(('jjai_cache_misses_total', {'kind': kind}, totals['misses']))
+        gauges.append(('jjai_cache_bytes', {}, stats['bytes']))
+    # The cache is shared by every worker, so its series carry no pid
+    shared = {'jjai_cache_hits_total', 'jjai_cache_misses_total', 'jjai_cache_bytes'}
+    return flask.Response(metrics.render(gauges, counters, shared), mimetype='text/plain; version=0.0.4')
+
+# Function to fetch stock and options data, or None for each part when
+# anything fails (load_data raises the error instead)
+def fetch_data(ticker, expiration_date, start_time, end_time, horizon_days=None, interval='5m'):
     try:
-        calls = stock.option_chain(expiration_date).calls
-        puts = stock.option_chain(expiration_date).puts
+        return load_data(ticker, expiration_date, start_time, end_time, horizon_days, interval)
     except Exception as e:
-        print(f"Error fetching options data: {e}")
-        return None, None, None, None, None
+        print(f"Error fetching data for {ticker}: {e}")
+        return None, None, None, None, None, None
+
+# (with horizon_days, levels are summed over every expiration in that horizon)
+@timed('fetch_data')
+def load_data(ticker, expiration_date, start_time, end_time, horizon_days=None, interval='5m'):
+    with span('fetch_data.expirations'):
+        expirations = provider.expirations(ticker)
+    dates = expirations_within(expirations, horizon_days) if horizon_days else []
+    if not dates:
+        dates = [snap_expiration(expirations, expiration_date)]
+    with span('fetch_data.option_chain'):
+        snapshots = fetch_chains(provider, ticker, dates)
+        chain = ChainSnapshot.merge(snapshots)
     
-    top_calls_oi = calls.nlargest(5, 'openInterest')[['strike', 'openInterest']]
-    top_puts_oi = puts.nlargest(5, 'openInterest')[['strike', 'openInterest']]
-    top_calls_vol = calls.nlargest(5, 'volume')[['strike', 'volume']]
-    top_puts_vol = puts.nlargest(5, 'volume')[['strike', 'volume']]
+    with span('fetch_data.nlargest'):
+        top_calls_oi = chain.top('calls', 'openInterest', 5)
+        top_puts_oi = chain.top('puts', 'openInterest', 5)
+        top_calls_vol = chain.top('calls', 'volume', 5)
+        top_puts_vol = chain.top('puts', 'volume', 5)
     
-    data = stock.history(start=start_time, end=end_time, interval='5m')
+    with span('fetch_data.history'):
+        data = provider.history(ticker, start_time, end_time, interval=interval)
+
+    # Max pain, put/call ratios, walls and gamma exposure around the last price
+    with span('fetch_data.levels'):
+        levels = compute_levels(snapshots, float(data['Close'].iloc[-1])) if not data.empty else None
     
-    return data, top_calls_oi, top_puts_oi, top_calls_vol, top_puts_vol
+    return data, top_calls_oi, top_puts_oi, top_calls_vol, top_puts_vol, levels
+
+# Function to fetch historical data for additional charts, for every ticker
+# of the row in one coalesced fan-out (a request per ticker, run in parallel)
+@timed('fetch_chart_data')
+def fetch_chart_data(tickers, interval='1h'):
+    end_time = datetime.now(pytz.timezone('US/Eastern'))
+    start_time = end_time - timedelta(days=1)
+    return provider.history_many(tickers, start_time, end_time, interval=interval)
 
-# Function to fetch historical data for additional charts
-def fetch_chart_data(ticker, interval='1h'):
-    stock = yf.Ticker(ticker)
+# The bars a small chart last had, however old, without asking upstream
+def stored_chart_data(ticker, interval='1h'):
     end_time = datetime.now(pytz.timezone('US/Eastern'))
     start_time = end_time - timedelta(days=1)
-    data = stock.history(start=start_time, end=end_time, interval=interval)
-    return data
+    return provider.stored_history(ticker, start_time, end_time, interval=interval)
 
 # Function to create small charts
 # Function to create small charts with percentage change
-def create_chart(ticker):
-    data = fetch_chart_data(ticker)
+@timed('create_chart')
+def create_chart(ticker, data):
     fig = go.Figure()
     if not data.empty:
         fig.add_trace(go.Candlestick(
@@ -68,9 +151,12 @@ def create_chart(ticker):
             color = 'red'
 
         
+        # Flag bars kept from before an upstream failure
+        stale = "  (stale)" if provider.is_stale(ticker, interval='1h') else ""
+
         # Set the title Layout
         fig.update_layout(
-            title=f"{ticker} ({percent_change_str} today)",
+            title=f"{ticker} ({percent_change_str} today){stale}",
             xaxis_title='',
             yaxis_title='',
             plot_bgcolor='black',
@@ -83,8 +169,258 @@ def create_chart(ticker):
         )
     return fig
 
+# Index ETFs shown in the top row, by the id of their graph
+INDEX_TICKERS = ['QQQ', 'SPY', 'IWM', 'DIA']
+INDEX_CHART_IDS = {'QQQ': 'chart-QQQ', 'SPY': 'chart-SPY', 'IWM': 'chart-RUSELL 2000', 'DIA': 'chart-DOW'}
+
+# How often the small charts are refreshed in the browser
+MINI_CHART_REFRESH_MS = int(os.environ.get('JJAI_MINI_CHART_REFRESH_MS', 60000))
+
+# Expirations summed in the "all expirations" mode, in days ahead
+HORIZON_DAYS = int(os.environ.get('JJAI_HORIZON_DAYS', 30))
+
+# How often the main chart polls for new bars in live mode
+LIVE_REFRESH_MS = int(os.environ.get('JJAI_LIVE_REFRESH_MS', 60000))
+
+# Seconds to wait for the mini-charts before showing a placeholder
+CHART_TIMEOUT = float(os.environ.get('JJAI_CHART_TIMEOUT', 5))
+
+# Shared pool so a stuck download never blocks the caller past its timeout
+chart_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix='chart')
+
+# Function to create an empty small chart when data is unavailable
+def placeholder_chart(ticker, message):
+    fig = go.Figure()
+    fig.update_layout(
+        title=f"{ticker} ({message})",
+        plot_bgcolor='black',
+        paper_bgcolor='black',
+        font=dict(color='white', size=6),
+        xaxis=dict(visible=False),
+        yaxis=dict(visible=False),
+        margin=dict(l=1, r=5, t=20, b=0),
+    )
+    return fig
+
+# Function to create several small charts from one coalesced fan-out. A
+# ticker whose bars are late or failed shows the bars it last had, if any;
+# `complete` is False until every chart is drawn from fresh bars.
+def create_charts(tickers, timeout=CHART_TIMEOUT):
+    future = chart_pool.submit(fetch_chart_data, tickers)
+    wait([future], timeout=timeout)
+    bars, errors = {}, {}
+    if future.done():
+        try:
+            bars = future.result()
+        except PartialHistory as e:
+            bars, errors = e.bars, e.errors
+        except Exception as e:
+            errors = dict.fromkeys(tickers, e)
+
+    charts = {}
+    for ticker in tickers:
+        data = bars.get(ticker)
+        if data is None:
+            if ticker in errors:
+                print(f"Error creating chart for {ticker}: {errors[ticker]}")
+            data = stored_chart_data(ticker)
+        if data is None:
+            charts[ticker] = placeholder_chart(ticker, 'unavailable' if ticker in errors else 'loading')
+        else:
+            charts[ticker] = create_chart(ticker, data)
+    return charts, all(ticker in bars for ticker in tickers)
+
+
+# Tickers offered to the scanner by default
+SCAN_UNIVERSE = parse_tickers(os.environ.get('JJAI_SCAN_UNIVERSE', '')) or watchlist(INDEX_TICKERS)
+
+# Scan progress and API responses are kept in the cache shared by all
+# workers, so any worker can serve them
+shared_cache = getattr(provider, 'cache', None) or make_cache()
 
-# Layout
+SCAN_COLUMNS = [
+    ('ticker', 'Ticker'), ('expiration', 'Expiration'), ('last', 'Last'),
+    ('call_oi_strikes', 'Top call OI'), ('put_oi_strikes', 'Top put OI'),
+    ('call_wall', 'Call wall'), ('put_wall', 'Put wall'), ('max_pain', 'Max pain'),
+    ('pc_oi', 'P/C OI'), ('net_gex_m', 'Net GEX $M/1%'),
+]
+
+# Function computing the key strike levels of one ticker for the scanner,
+# on its nearest expiration
+def scan_ticker(ticker):
+    expirations = provider.expirations(ticker)
+    if not expirations:
+        raise ValueError('no listed options')
+    end_time = datetime.now(pytz.timezone('US/Eastern'))
+    start_time = end_time - timedelta(days=1)
+    data, top_calls_oi, top_puts_oi, _, _, levels = load_data(ticker, expirations[0], start_time, end_time)
+    if levels is None:
+        raise ValueError('no price bars')
+    return {
+        'ticker': ticker,
+        'expiration': levels.expirations[0],
+        'last': round(levels.spot, 2),
+        'call_oi_strikes': ', '.join(f"{k:g}" for k in top_calls_oi['strike'][:3]),
+        'put_oi_strikes': ', '.join(f"{k:g}" for k in top_puts_oi['strike'][:3]),
+        'call_wall': float(levels.call_wall),
+        'put_wall': float(levels.put_wall),
+        'max_pain': float(levels.max_pain),
+        'pc_oi': None if levels.put_call_oi_ratio is None else round(levels.put_call_oi_ratio, 2),
+        'net_gex_m': round(float(levels.net_gamma.sum()) / 1e6, 1),
+    }
+
+# Scan a universe (?tickers=A,B,C) streaming one JSON line per ticker as it
+# completes, then a summary line with the throughput
+@server.route('/api/scan')
+def scan_api():
+    tickers = parse_tickers(flask.request.args.get('tickers', '')) or SCAN_UNIVERSE
+
+    def stream():
+        started = time.time()
+        for ticker, row, error in run_scan(scan_ticker, tickers):
+            row = row if error is None else {'ticker': ticker, 'error': error}
+            yield json.dumps(to_jsonable(row), allow_nan=False) + '\n'
+        yield json.dumps({
+            'done': len(tickers),
+            'seconds': round(time.time() - started, 3),
+            'tickers_per_second': round(throughput(len(tickers), started), 2),
+        }) + '\n'
+
+    return flask.Response(flask.stream_with_context(stream()), mimetype='application/x-ndjson')
+
+
+# HTTP API: the same data as the dashboard as JSON (default) or, for the
+# `table` part, Parquet/Arrow via ?format= or the Accept header
+
+# Levels of one ticker (?expiration=YYYY-MM-DD, ?horizon=days to sum expirations)
+@server.route('/api/levels/<ticker>')
+def levels_api(ticker):
+    ticker = ticker.upper()
+    expiration_date = flask.request.args.get('expiration', datetime.today().strftime('%Y-%m-%d'))
+    horizon_days = flask.request.args.get('horizon', type=int)
+
+    def build():
+        end_time = datetime.now(pytz.timezone('US/Eastern'))
+        start_time = end_time - timedelta(days=1)
+        data, top_calls_oi, top_puts_oi, top_calls_vol, top_puts_vol, levels = fetch_data(
+            ticker, expiration_date, start_time, end_time, horizon_days=horizon_days
+        )
+        if levels is None:
+            flask.abort(404, f"No options data for {ticker}")
+        return {
+            'ticker': ticker,
+            'spot': levels.spot,
+            'expirations': levels.expirations,
+            'max_pain': levels.max_pain,
+            'put_call_oi_ratio': levels.put_call_oi_ratio,
+            'put_call_volume_ratio': levels.put_call_volume_ratio,
+            'call_wall': levels.call_wall,
+            'put_wall': levels.put_wall,
+            'top_calls_oi': top_calls_oi,
+            'top_puts_oi': top_puts_oi,
+            'top_calls_volume': top_calls_vol,
+            'top_puts_volume': top_puts_vol,
+            'table': pd.DataFrame({
+                'strike': levels.strikes,
+                'call_oi': levels.call_oi,
+                'put_oi': levels.put_oi,
+                'net_gamma': levels.net_gamma,
+            }),
+        }
+
+    return cached_response(shared_cache, flask.request.full_path, TTLS['chain'], build)
+
+# Price bars of one ticker (?days=1, ?interval=5m); `t` is epoch seconds
+@server.route('/api/bars/<ticker>')
+def bars_api(ticker):
+    ticker = ticker.upper()
+    days = flask.request.args.get('days', 1, type=int)
+    interval = flask.request.args.get('interval', '5m')
+    try:
+        ttl = bar_aligned_ttl(interval)
+    except ValueError as e:
+        flask.abort(400, str(e))
+    if days < 1:
+        flask.abort(400, "days must be at least 1")
+    if days > RETENTION_DAYS.get(interval, days):
+        flask.abort(400, f"{interval} bars only go back {RETENTION_DAYS[interval]} days")
+
+    def build():
+        end_time = datetime.now(pytz.timezone('US/Eastern'))
+        data = provider.history(ticker, end_time - timedelta(days=days), end_time, interval=interval)
+        table = data[['Open', 'High', 'Low', 'Close', 'Volume']]
+        table = table.rename_axis('t').rename(columns=str.lower)
+        return {'ticker': ticker, 'interval': interval, 'table': table}
+
+    return cached_response(shared_cache, flask.request.full_path, ttl, build)
+
+# Day change of the index ETFs shown in the top row
+@server.route('/api/minis')
+def minis_api():
+    def build():
+        rows = []
+        try:
+            frames = fetch_chart_data(INDEX_TICKERS)
+        except PartialHistory as e:
+            frames = e.bars
+        for ticker, data in frames.items():
+            if data.empty:
+                continue
+            opening_price = float(data['Open'].iloc[0])
+            closing_price = float(data['Close'].iloc[-1])
+            rows.append({
+                'ticker': ticker,
+                'open': opening_price,
+                'last': closing_price,
+                'change_pct': (closing_price - opening_price) / opening_price * 100,
+                'as_of': data.index[-1],
+            })
+        return {'table': pd.DataFrame(rows, columns=['ticker', 'open', 'last', 'change_pct', 'as_of'])}
+
+    return cached_response(shared_cache, flask.request.full_path, MINI_CHART_REFRESH_MS / 1000, build)
+
+
+# Rendered figures of the whole top row as one JSON object by ticker, built
+# once per refresh interval for every viewer and kept precompressed
+def mini_chart_figures():
+    def build():
+        charts, complete = create_charts(INDEX_TICKERS)
+        body = ('{' + ','.join(f'"{ticker}":{charts[ticker].to_json()}' for ticker in INDEX_TICKERS) + '}').encode()
+        return {
+            'variants': compress_variants(body),
+            'etag': hashlib.sha1(body).hexdigest(),
+            # Retry soon when a chart is a placeholder or shows old bars
+            'complete': complete,
+        }
+
+    # One build per expiry for all workers; the others wait for it
+    def load():
+        entry = shared_cache.peek('figure', 'minis')
+        if entry is None:
+            entry = build()
+            shared_cache.set('figure', 'minis', entry, MINI_CHART_REFRESH_MS / 1000 if entry['complete'] else 5)
+        return entry
+
+    entry = shared_cache.get('figure', 'minis')
+    if entry is None:
+        try:
+            entry = shared_cache.single_flight('figure', 'minis', load)
+        except UpstreamUnavailable:
+            # Another worker is still building them; serve the previous ones
+            entry = shared_cache.get_stale('figure', 'minis')
+            if entry is None:
+                raise
+    return entry
+
+@server.route('/api/minis/figures')
+def mini_figures_api():
+    entry = mini_chart_figures()
+    remaining = shared_cache.expires_in('figure', 'minis') or 0
+    return precompressed_response(entry['variants'], entry['etag'], 'application/json', remaining)
+
+
+# Layout (no data is fetched at import; the small charts start as
+# placeholders and are filled in from /api/minis/figures)
 app.layout = html.Div(
     style={'backgroundColor': 'black', 'color': 'white', 'padding': '20px', 'display': 'flex'},
     children=[
@@ -105,8 +441,13 @@ app.layout = html.Div(
                 html.Button("1D", id="filter-1d", n_clicks=0, style={'margin': '5px', 'backgroundColor': 'gray', 'color': 'white'}),
                 html.Button("1W", id="filter-1w", n_clicks=0, style={'margin': '5px', 'backgroundColor': 'gray', 'color': 'white'}),
                 html.Button("1M", id="filter-1m", n_clicks=0, style={'margin': '5px', 'backgroundColor': 'gray', 'color': 'white'}),
+                html.Button("3M", id="filter-3m", n_clicks=0, style={'margin': '5px', 'backgroundColor': 'gray', 'color': 'white'}),
+                html.Button("6M", id="filter-6m", n_clicks=0, style={'margin': '5px', 'backgroundColor': 'gray', 'color': 'white'}),
+                html.Button("1Y", id="filter-1y", n_clicks=0, style={'margin': '5px', 'backgroundColor': 'gray', 'color': 'white'}),
                 html.Button("Scale Up", id="scale-up", n_clicks=0, style={'margin': '5px', 'backgroundColor': 'gray', 'color': 'white'}),
                 html.Button("Scale Down", id="scale-down", n_clicks=0, style={'margin': '5px', 'backgroundColor': 'gray', 'color': 'white'}),
+                dcc.Checklist(id='live-toggle', options=[{'label': ' Live', 'value': 'live'}], value=[], style={'margin': '5px'}),
+                dcc.Checklist(id='aggregate-toggle', options=[{'label': f' All expirations {HORIZON_DAYS}d', 'value': 'all'}], value=[], style={'margin': '5px'}),
                 dcc.Input(id="symbol-input", type="text", debounce=True, placeholder="Enter ticker", style={'margin': '10px', 'color': 'black'}),
                 dcc.DatePickerSingle(
                     id='expiration-date-picker',
@@ -128,22 +469,22 @@ app.layout = html.Div(
                     children=[
                         dcc.Graph(
                             id='chart-QQQ',
-                            figure=create_chart('QQQ'),
+                            figure=placeholder_chart('QQQ', 'loading'),
                             style={'width': '200px', 'display': 'inline-block', 'height': '220px', 'border': '1px solid white', 'padding': '0px'}
                         ),
                         dcc.Graph(
                             id='chart-SPY',
-                            figure=create_chart('SPY'),
+                            figure=placeholder_chart('SPY', 'loading'),
                             style={'width': '200px', 'display': 'inline-block', 'height': '220px', 'border': '1px solid white', 'padding': '0px'}
                         ),
                         dcc.Graph(
                             id='chart-RUSELL 2000',
-                            figure=create_chart('IWM'),
+                            figure=placeholder_chart('IWM', 'loading'),
                             style={'width': '200px', 'display': 'inline-block', 'height': '220px', 'border': '1px solid white', 'padding': '0px'}
                         ),
                         dcc.Graph(
                             id='chart-DOW',
-                            figure=create_chart('DIA'),
+                            figure=placeholder_chart('DIA', 'loading'),
                             style={'width': '200px', 'display': 'inline-block', 'height': '220px', 'border': '1px solid white', 'padding': '0px'}
                         )
                     ],
@@ -151,79 +492,396 @@ app.layout = html.Div(
                 ),
 
                 # Main chart below the small charts
-                dcc.Graph(id='options-graph')
+                dcc.Graph(id='options-graph'),
+                dcc.Interval(id='live-interval', interval=LIVE_REFRESH_MS, disabled=True),
+                dcc.Store(id='live-state'),
+                dcc.Store(id='chart-window', data='1D'),
+                dcc.Store(id='chart-scale', data=1),
+
+                dcc.Interval(id='mini-chart-interval', interval=MINI_CHART_REFRESH_MS, n_intervals=0),
+
+                # Scanner for key strike levels over a ticker universe
+                html.Div(
+                    style={'marginTop': '20px'},
+                    children=[
+                        html.H3('Key Strike Scanner', style={'color': 'white'}),
+                        dcc.Textarea(id='scan-tickers', value=', '.join(SCAN_UNIVERSE), style={'width': '100%', 'height': '60px', 'color': 'black'}),
+                        html.Button("Scan", id="scan-button", n_clicks=0, style={'margin': '5px', 'backgroundColor': 'gray', 'color': 'white'}),
+                        html.Div(id='scan-status', style={'margin': '5px'}),
+                        dash_table.DataTable(
+                            id='scan-table',
+                            columns=[{'name': name, 'id': column} for column, name in SCAN_COLUMNS],
+                            data=[],
+                            sort_action='native',
+                            style_header={'backgroundColor': 'gray', 'color': 'white'},
+                            style_cell={'backgroundColor': 'black', 'color': 'white'},
+                        ),
+                        dcc.Interval(id='scan-interval', interval=1000, disabled=True),
+                        dcc.Store(id='scan-job'),
+                    ]
+                )
             ]
         )
     ]
 )
 
-# Callback for scaling charts and filtering data
+# Callback filling the small charts on page load and on every refresh tick.
+# Runs in the browser and loads the shared, pre-serialized figures, so the
+# server builds them once per interval however many people are watching.
+app.clientside_callback(
+    """
+    async function(n_intervals) {
+        const response = await fetch('%s');
+        if (!response.ok) {
+            return window.dash_clientside.no_update;
+        }
+        const figures = await response.json();
+        return %s.map(ticker => figures[ticker]);
+    }
+    """ % (app.get_relative_path('/api/minis/figures'), json.dumps(INDEX_TICKERS)),
+    [dd.Output(INDEX_CHART_IDS[ticker], 'figure') for ticker in INDEX_TICKERS],
+    [dd.Input('mini-chart-interval', 'n_intervals')]
+)
+
+# Callback starting a scan and filling its table as tickers complete
+@app.callback(
+    [dd.Output('scan-job', 'data'),
+     dd.Output('scan-table', 'data'),
+     dd.Output('scan-status', 'children'),
+     dd.Output('scan-interval', 'disabled')],
+    [dd.Input('scan-button', 'n_clicks'),
+     dd.Input('scan-interval', 'n_intervals')],
+    [dd.State('scan-tickers', 'value'),
+     dd.State('scan-job', 'data')],
+    prevent_initial_call=True
+)
+def update_scan(_, __, tickers_text, job_id):
+    ctx = dash.callback_context
+    if ctx.triggered and ctx.triggered[0]['prop_id'] == 'scan-button.n_clicks':
+        tickers = parse_tickers(tickers_text or '')
+        if not tickers:
+            return None, [], "Enter tickers to scan", True
+        job_id = ScanJob(scan_ticker, tickers, shared_cache).start().id
+
+    state = scan_progress(shared_cache, job_id) if job_id else None
+    if state is None:
+        return None, [], "Scan expired", True
+
+    done = len(state['rows']) + len(state['errors'])
+    status = f"{done}/{state['total']} tickers, {state['tickers_per_second']:.1f} tickers/s"
+    if state['errors']:
+        status += f", {len(state['errors'])} failed ({', '.join(sorted(state['errors']))})"
+    return job_id, state['rows'], status, state['finished'] is not None
+
+
+# Time windows of the main chart: how far back each goes and which bars it
+# is drawn from. The chart has one trace per bar interval; the filter buttons
+# show the trace of the chosen window and set the axes to it, in the browser.
+TIME_WINDOWS = {
+    '1D': (timedelta(days=1), '5m'),
+    '1W': (timedelta(weeks=1), '5m'),
+    '1M': (timedelta(weeks=4), '5m'),
+    '3M': (timedelta(weeks=13), '1h'),
+    '6M': (timedelta(weeks=26), '1h'),
+    '1Y': (timedelta(days=365), '1d'),
+}
+FILTER_IDS = {label: f"filter-{label.lower()}" for label in TIME_WINDOWS}
+
+# Bar intervals of the main chart, in the order of their traces
+BAR_INTERVALS = list(dict.fromkeys(interval for length, interval in TIME_WINDOWS.values()))
+
+# Layout template of a default plotly figure, for figures built as plain dicts
+FIGURE_TEMPLATE = go.Figure().to_dict()['layout']['template']
+
+def window_span(interval, pick=max):
+    return pick(length for length, i in TIME_WINDOWS.values() if i == interval)
+
+# Function to fetch the widest window of each bar interval the filters use
+# (the 5m bars come with the options data; hourly and daily bars are read
+# mostly from the local bar archive)
+def fetch_windows(ticker, data, end_time):
+    bars = {'5m': data}
+    for interval in BAR_INTERVALS:
+        if interval in bars:
+            continue
+        try:
+            bars[interval] = provider.history(ticker, end_time - window_span(interval), end_time, interval=interval)
+        except Exception as e:
+            print(f"Error fetching {interval} history: {e}")
+            bars[interval] = data.iloc[:0]
+    return bars
+
+# A trace thinned to about the chart width, except for its shortest window,
+# which keeps every bar
+def thin(frame, keep):
+    if frame.empty:
+        return frame
+    recent = frame.index > frame.index[-1] - keep
+    older = downsample(frame[~recent], 'Close', max(MAX_POINTS - int(recent.sum()), 3))
+    return pd.concat([older, frame[recent]])
+
+# Bar time as plotly reads it: wall-clock time, any UTC offset ignored
+def wall_clock(ts):
+    return ts.strftime('%Y-%m-%dT%H:%M:%S')
+
+# Points of a trace: wall-clock strings (shorter than ISO times with an
+# offset) and closes as a plain list, the form live mode extends them in. The
+# closes are stored as float32, so more than 4 decimals would be noise.
+def trace_x(frame):
+    return [wall_clock(ts) for ts in frame.index]
+
+def trace_y(frame):
+    return frame['Close'].round(4).tolist()
+
+# Axis ranges showing the last `length` of a trace, computed the same way as
+# by the filter buttons in the browser
+def window_ranges(frame, length):
+    times = frame.index.tz_localize(None) if frame.index.tz is not None else frame.index
+    start = times[-1] - length
+    shown = frame['Close'][times > start]
+    low, high = float(shown.min()), float(shown.max())
+    pad = (high - low) * 0.05 or 1
+    return [wall_clock(start), wall_clock(times[-1])], [low - pad, high + pad]
+
+# Horizontal line with a label at its right end, drawn like fig.add_hline
+# does but returned as (shape, annotation) so a figure takes them all at once
+# (add_hline re-validates every shape already in the figure)
+def hline(y, line, text, below=False):
+    shape = dict(type='line', xref='x domain', x0=0, x1=1, yref='y', y0=y, y1=y, line=line)
+    label = dict(text=text, xref='x domain', x=1, xanchor='right', yref='y', y=y,
+                 yanchor='top' if below else 'bottom', showarrow=False)
+    return shape, label
+
+# Callback building the main chart for a ticker and expiration
 @app.callback(
     [dd.Output('options-graph', 'figure'),
-     dd.Output('chart-QQQ', 'style'),
-     dd.Output('chart-SPY', 'style'),
-     dd.Output('chart-RUSELL 2000', 'style'),
-     dd.Output('chart-DOW', 'style')],
+     dd.Output('live-state', 'data')],
     [dd.Input('symbol-input', 'value'),
      dd.Input('expiration-date-picker', 'date'),
-     dd.Input('filter-1d', 'n_clicks'),
-     dd.Input('filter-1w', 'n_clicks'),
-     dd.Input('filter-1m', 'n_clicks'),
-     dd.Input('scale-up', 'n_clicks'),
-     dd.Input('scale-down', 'n_clicks')]
+     dd.Input('aggregate-toggle', 'value')],
+    [dd.State('chart-window', 'data')]
 )
-def update_charts(ticker, expiration_date, filter_1d, filter_1w, filter_1m, scale_up, scale_down):
-    ctx = dash.callback_context
-
+@timed('update_charts', profile=True)
+def update_charts(ticker, expiration_date, aggregate, window):
     if not ticker:
-        return go.Figure(), {'height': '220px'}, {'height': '220px'}, {'height': '220px'}, {'height': '220px'}
+        return go.Figure(), None
+    window = window if window in TIME_WINDOWS else '1D'
+
+    # The widest 5m window; shorter ones are cut from it
+    end_time = datetime.now(pytz.timezone('US/Eastern'))
+    start_time = end_time - window_span('5m')
 
-    # Handle time filtering based on button clicks
-    if ctx.triggered:
-        button_id = ctx.triggered[0]['prop_id'].split('.')[0]
-        
-        if button_id == 'filter-1d':
-            start_time = datetime.now(pytz.timezone('US/Eastern')) - timedelta(days=1)
-            end_time = datetime.now(pytz.timezone('US/Eastern'))
-        elif button_id == 'filter-1w':
-            start_time = datetime.now(pytz.timezone('US/Eastern')) - timedelta(weeks=1)
-            end_time = datetime.now(pytz.timezone('US/Eastern'))
-        elif button_id == 'filter-1m':
-            start_time = datetime.now(pytz.timezone('US/Eastern')) - timedelta(weeks=4)
-            end_time = datetime.now(pytz.timezone('US/Eastern'))
-        else:
-            start_time = datetime.now(pytz.timezone('US/Eastern')) - timedelta(days=1)
-            end_time = datetime.now(pytz.timezone('US/Eastern'))
-    
     # Fetch main chart data
-    data, top_calls_oi, top_puts_oi, top_calls_vol, top_puts_vol = fetch_data(ticker, expiration_date, start_time, end_time)
+    data, top_calls_oi, top_puts_oi, top_calls_vol, top_puts_vol, levels = fetch_data(
+        ticker, expiration_date, start_time, end_time,
+        horizon_days=HORIZON_DAYS if 'all' in (aggregate or []) else None
+    )
     if data is None or data.empty:
-        return go.Figure(), {'height': '220px'}, {'height': '220px'}, {'height': '220px'}, {'height': '220px'}
+        # Nothing cached to fall back on either; say so rather than show a blank chart
+        fig = placeholder_chart(ticker, 'data unavailable').update_layout(font=dict(size=14))
+        return fig, None
 
-    # Create the main chart figure
-    fig = go.Figure()
-    fig.add_trace(go.Scatter(x=data.index, y=data['Close'], mode='lines', name='Price', line=dict(color='white', width=2)))
-    
-    for strike in top_calls_oi['strike']:
-        fig.add_hline(y=strike, line=dict(color='green', width=1), annotation_text=f" {strike}")
-    for strike in top_puts_oi['strike']:
-        fig.add_hline(y=strike, line=dict(color='red', width=1), annotation_text=f"{strike}")
-    
-    fig.update_layout(
-        title=ticker,
-        xaxis_title='Time',
-        yaxis_title='Price',
-        plot_bgcolor='black',
-        paper_bgcolor='black',
-        font=dict(color='white'),
-        xaxis_rangeslider_visible=False
-    )
+    with span('update_charts.history'):
+        bars = fetch_windows(ticker, data, end_time)
 
-    # Scaling logic for small charts
-    new_style = {'width': '200px', 'display': 'inline-block', 'height': '220px', 'border': '1px solid white', 'padding': '0px'}
-    
-    # Return the updated figure and the styles for each chart
-    return fig, new_style, new_style, new_style, new_style
+    with span('update_charts.downsample'):
+        traces = {interval: thin(bars[interval], window_span(interval, min)) for interval in BAR_INTERVALS}
+
+    with span('update_charts.figure'):
+        lines = [hline(strike, dict(color='green', width=1), f" {strike}") for strike in top_calls_oi['strike']]
+        lines += [hline(strike, dict(color='red', width=1), f"{strike}") for strike in top_puts_oi['strike']]
+        lines.append(hline(levels.max_pain, dict(color='yellow', width=1, dash='dash'), f"Max pain {levels.max_pain}", below=True))
+
+        # Plain dicts rather than go.Scatter, which validates every point
+        length, shown = TIME_WINDOWS[window]
+        data_traces = [
+            dict(type='scatter', x=trace_x(frame), y=trace_y(frame), mode='lines',
+                 name=interval, visible=interval == shown, line=dict(color='white', width=2))
+            for interval, frame in traces.items()
+        ]
+        xaxis = dict(title=dict(text='Time'), rangeslider=dict(visible=False))
+        yaxis = dict(title=dict(text='Price'))
+        if not traces[shown].empty:
+            xaxis['range'], yaxis['range'] = window_ranges(traces[shown], length)
+
+        # Title with the put/call open interest ratio and total gamma exposure
+        title = ticker
+        if len(levels.expirations) > 1:
+            title += f"  {len(levels.expirations)} expirations to {levels.expirations[-1]}"
+        else:
+            title += f"  exp {levels.expirations[0]}"
+        if levels.put_call_oi_ratio is not None:
+            title += f"  P/C OI {levels.put_call_oi_ratio:.2f}"
+        title += f"  Net GEX ${levels.net_gamma.sum() / 1e6:,.1f}M/1%"
+        # Served from the cache past its TTL because upstream is failing
+        if provider.is_stale(ticker, levels.expirations, '5m'):
+            title += "  (stale)"
+
+        fig = {
+            'data': data_traces,
+            'layout': dict(
+                template=FIGURE_TEMPLATE,
+                title=dict(text=title),
+                xaxis=xaxis,
+                yaxis=yaxis,
+                plot_bgcolor='black',
+                paper_bgcolor='black',
+                font=dict(color='white'),
+                showlegend=False,
+                shapes=[shape for shape, _ in lines],
+                annotations=[label for _, label in lines],
+            ),
+        }
+
+    # Where live mode picks up: for each trace, the last bar drawn and its
+    # number of points
+    live_state = {
+        'ticker': ticker,
+        'traces': {
+            interval: {'last': frame.index[-1].isoformat(), 'count': len(frame)}
+            for interval, frame in traces.items() if not frame.empty
+        },
+    }
+
+    return fig, live_state
+
+
+# Callback for the filter buttons: shows the trace of the chosen window's bar
+# interval and sets both axes to the window, entirely in the browser
+app.clientside_callback(
+    """
+    function(...args) {
+        const figure = args[args.length - 1];
+        const triggered = window.dash_clientside.callback_context.triggered;
+        const windows = %s;
+        const intervals = %s;
+        const ids = %s;
+        const label = Object.keys(windows)[ids.indexOf(triggered[0].prop_id.split('.')[0])];
+        if (!figure || !figure.data || figure.data.length !== intervals.length) {
+            return [window.dash_clientside.no_update, label];
+        }
+        const [length, interval] = windows[label];
+        const trace = figure.data[intervals.indexOf(interval)];
+        const data = figure.data.map((t, i) => Object.assign({}, t, {visible: intervals[i] === interval}));
+        const xaxis = Object.assign({}, figure.layout.xaxis);
+        const yaxis = Object.assign({}, figure.layout.yaxis);
+        if (trace.x.length) {
+            // Wall-clock times, as plotly reads them
+            const end = trace.x[trace.x.length - 1].slice(0, 19);
+            const start = new Date(Date.parse(end + 'Z') - length).toISOString().slice(0, 19);
+            let low = Infinity, high = -Infinity;
+            trace.x.forEach((x, i) => {
+                if (x.slice(0, 19) > start) {
+                    low = Math.min(low, trace.y[i]);
+                    high = Math.max(high, trace.y[i]);
+                }
+            });
+            const pad = (high - low) * 0.05 || 1;
+            Object.assign(xaxis, {range: [start, end], autorange: false});
+            Object.assign(yaxis, {range: [low - pad, high + pad], autorange: false});
+        }
+        const layout = Object.assign({}, figure.layout, {xaxis: xaxis, yaxis: yaxis});
+        return [Object.assign({}, figure, {data: data, layout: layout}), label];
+    }
+    """ % (
+        json.dumps({label: [length.total_seconds() * 1000, interval] for label, (length, interval) in TIME_WINDOWS.items()}),
+        json.dumps(BAR_INTERVALS),
+        json.dumps(list(FILTER_IDS.values())),
+    ),
+    [dd.Output('options-graph', 'figure', allow_duplicate=True),
+     dd.Output('chart-window', 'data')],
+    [dd.Input(FILTER_IDS[label], 'n_clicks') for label in TIME_WINDOWS],
+    [dd.State('options-graph', 'figure')],
+    prevent_initial_call=True
+)
+
+# Callback for the scale buttons: resizes the small charts in the browser
+app.clientside_callback(
+    """
+    function(up, down, scale) {
+        const triggered = window.dash_clientside.callback_context.triggered[0].prop_id;
+        scale = scale || 1;
+        scale = triggered.startsWith('scale-up') ? Math.min(scale * 1.25, 3) : Math.max(scale / 1.25, 0.5);
+        const style = {
+            width: Math.round(200 * scale) + 'px', display: 'inline-block',
+            height: Math.round(220 * scale) + 'px', border: '1px solid white', padding: '0px',
+        };
+        return [style, style, style, style, scale];
+    }
+    """,
+    [dd.Output(INDEX_CHART_IDS[ticker], 'style') for ticker in INDEX_TICKERS] + [dd.Output('chart-scale', 'data')],
+    [dd.Input('scale-up', 'n_clicks'),
+     dd.Input('scale-down', 'n_clicks')],
+    [dd.State('chart-scale', 'data')],
+    prevent_initial_call=True
+)
+
+
+# Callback switching live updates of the main chart on and off
+@app.callback(
+    dd.Output('live-interval', 'disabled'),
+    [dd.Input('live-toggle', 'value')]
+)
+def toggle_live(value):
+    return 'live' not in (value or [])
+
+
+# Callback sending only the bars added since the last tick to the main chart,
+# as a Patch, instead of rebuilding the whole figure
+@app.callback(
+    [dd.Output('options-graph', 'figure', allow_duplicate=True),
+     dd.Output('live-state', 'data', allow_duplicate=True)],
+    [dd.Input('live-interval', 'n_intervals')],
+    [dd.State('live-state', 'data'),
+     dd.State('chart-window', 'data')],
+    prevent_initial_call=True
+)
+@timed('update_live')
+def update_live(_, live_state, window):
+    length, interval = TIME_WINDOWS.get(window, TIME_WINDOWS['1D'])
+    if not live_state or interval not in live_state.get('traces', {}):
+        raise PreventUpdate
+
+    # Only the trace on screen is updated, from the same window update_charts
+    # asked for, so it is served from the cache
+    state = live_state['traces'][interval]
+    last = pd.Timestamp(state['last'])
+    end_time = datetime.now(pytz.timezone('US/Eastern'))
+    bars = provider.history(live_state['ticker'], end_time - window_span(interval), end_time, interval=interval)
+    data = bars[bars.index >= last]
+    if data.empty:
+        raise PreventUpdate
+
+    patched = dash.Patch()
+    current = data[data.index == last]
+    new_bars = data[data.index > last]
+    count = state['count']
+    price = patched['data'][BAR_INTERVALS.index(interval)]
+
+    # The last bar drawn may still have been forming; overwrite its close
+    if not current.empty:
+        price['y'][count - 1] = trace_y(current)[-1]
+
+    if not new_bars.empty:
+        price['x'].extend(trace_x(new_bars))
+        price['y'].extend(trace_y(new_bars))
+        state = {'last': new_bars.index[-1].isoformat(), 'count': count + len(new_bars)}
+        live_state = dict(live_state, traces=dict(live_state['traces'], **{interval: state}))
+
+        # Keep the window on screen moving with the new bars
+        patched['layout']['xaxis']['range'], patched['layout']['yaxis']['range'] = window_ranges(bars, length)
+
+    return patched, live_state
+
+
+# Keep the index ETFs and JJAI_WATCHLIST warm in the cache; without the
+# scheduler, at least warm the small charts so the first page load is cached
+prefetcher = start_prefetch(provider, watchlist(INDEX_TICKERS))
+if prefetcher is None:
+    chart_pool.submit(create_charts, INDEX_TICKERS)
+
+STARTUP_SECONDS = time.perf_counter() - BOOT_STARTED
+print(f"JJAI ready in {STARTUP_SECONDS * 1000:.0f} ms")
 
 
 if __name__ == '__main__':
@@ -16,8 +16,8 @@ def fetch_data(ticker, expiration_date):
     
     try:
         # Try to fetch the options data for the given expiration date
-        calls = stock.option_chain(expiration_date).calls
-        puts = stock.option_chain(expiration_date).puts
+        chain = stock.option_chain(expiration_date)
+        calls, puts = chain.calls, chain.puts
     except Exception as e:
         print(f"Error fetching options data: {e}")
         return None, None, None, None, None
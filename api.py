@@ -0,0 +1,131 @@
+import io
+import gzip
+import json
+import math
+import hashlib
+
+import flask
+import numpy as np
+import pandas as pd
+
+from governor import UpstreamUnavailable
+
+# Response formats of the HTTP API, by ?format= value
+FORMATS = {
+    'json': 'application/json',
+    'parquet': 'application/vnd.apache.parquet',
+    'arrow': 'application/vnd.apache.arrow.stream',
+}
+
+
+# ?format= wins over the Accept header; JSON when neither asks for anything else
+def requested_format(request):
+    fmt = request.args.get('format')
+    if fmt:
+        if fmt not in FORMATS:
+            flask.abort(400, f"Unknown format: {fmt}")
+        return fmt
+    best = request.accept_mimetypes.best_match(list(FORMATS.values()), default=FORMATS['json'])
+    return next(name for name, mimetype in FORMATS.items() if mimetype == best)
+
+
+# Timestamps become epoch seconds so every format carries plain numbers
+def _plain_frame(frame):
+    frame = frame.reset_index() if isinstance(frame.index, pd.DatetimeIndex) else frame.reset_index(drop=True)
+    for column in frame.columns:
+        if pd.api.types.is_datetime64_any_dtype(frame[column]):
+            frame[column] = pd.to_datetime(frame[column], utc=True).dt.as_unit('s').astype('int64')
+    return frame
+
+
+# Missing values (NaN, inf) become null, which JSON can carry
+def to_jsonable(value):
+    if isinstance(value, pd.DataFrame):
+        frame = _plain_frame(value).replace([np.inf, -np.inf], np.nan)
+        return frame.astype(object).where(frame.notna(), None).to_dict(orient='list')
+    if isinstance(value, dict):
+        return {k: to_jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [to_jsonable(v) for v in value]
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+# Encode a payload: JSON for anything, Parquet/Arrow for its `table` frame
+def encode(payload, fmt):
+    if fmt == 'json':
+        return json.dumps(to_jsonable(payload), separators=(',', ':'), allow_nan=False).encode()
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        flask.abort(406, "Parquet/Arrow output needs pyarrow installed")
+    table = pa.Table.from_pandas(_plain_frame(payload['table']), preserve_index=False)
+    buffer = io.BytesIO()
+    if fmt == 'parquet':
+        pq.write_table(table, buffer)
+    else:
+        with pa.ipc.new_stream(buffer, table.schema) as writer:
+            writer.write_table(table)
+    return buffer.getvalue()
+
+
+# Serve build() from the shared cache for max_age seconds, with an ETag so
+# clients revalidate with If-None-Match and get a 304 without a body.
+# Concurrent misses build the response once.
+def cached_response(cache, key, max_age, build):
+    request = flask.request
+    fmt = requested_format(request)
+    entry_key = f"{key}|{fmt}"
+
+    def load():
+        body = encode(build(), fmt)
+        return {'body': body, 'etag': hashlib.sha1(body).hexdigest()}
+
+    try:
+        entry = cache.get_or_load('api', entry_key, load, max_age)
+    except UpstreamUnavailable:
+        # Another request is still building it; answer with the last one built
+        entry = cache.get_stale('api', entry_key)
+        if entry is None:
+            raise
+
+    remaining = cache.expires_in('api', entry_key)
+    response = flask.Response(entry['body'], mimetype=FORMATS[fmt])
+    response.set_etag(entry['etag'])
+    response.cache_control.public = True
+    response.cache_control.max_age = max(0, int(max_age if remaining is None else remaining))
+    response.vary.add('Accept')
+    return response.make_conditional(request)
+
+
+# The body plus gzip (and brotli, when installed) versions, compressed once
+def compress_variants(body):
+    variants = {'identity': body, 'gzip': gzip.compress(body, compresslevel=6)}
+    try:
+        import brotli
+        variants['br'] = brotli.compress(body)
+    except ImportError:
+        pass
+    return variants
+
+
+# Serve a precompressed entry built by compress_variants in the best encoding
+# the client accepts
+def precompressed_response(variants, etag, mimetype, max_age):
+    request = flask.request
+    encoding = next(
+        (e for e in ('br', 'gzip') if e in variants and request.accept_encodings[e]),
+        'identity',
+    )
+    response = flask.Response(variants[encoding], mimetype=mimetype)
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = max(0, int(max_age))
+    response.vary.add('Accept-Encoding')
+    return response.make_conditional(request)
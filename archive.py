@@ -0,0 +1,178 @@
+import os
+import json
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from bars import BAR_COLUMNS, RETENTION_DAYS, PartialHistory, _eastern, pack, unpack
+from cache import private_dir
+
+# One record per bar, the same fields and types as the cached bars
+BAR_DTYPE = np.dtype([('time', 'uint32')] + list(BAR_COLUMNS.items()))
+
+# Period each archive file covers: a day of minute bars, a month of hourly
+# and daily ones (a 1Y view then opens 12 files rather than 365)
+PARTITIONS = {'1h': 'M', '1d': 'M', '1wk': 'Y'}
+
+
+# Bars of finished periods kept on disk, one memory-mapped .npy file per
+# ticker, interval and day or month, so long lookbacks load locally and
+# survive restarts. Periods missing from the archive are backfilled with one
+# upstream call; only the bars of the current period come from upstream.
+class BarArchive:
+    def __init__(self, source, root):
+        self.source = source
+        self.root = root
+
+    def history(self, ticker, start, end, interval='5m'):
+        return self.history_many([ticker], start, end, interval)[ticker]
+
+    # The current period of every ticker comes from one coalesced fan-out of
+    # per-ticker upstream requests
+    def history_many(self, tickers, start, end, interval='5m', on_bars=None):
+        start = _eastern(start)
+        end = _eastern(end)
+        freq = PARTITIONS.get(interval, 'D')
+        current = _period_start(pd.Timestamp.now(tz='US/Eastern').tz_localize(None).to_period(freq))
+
+        frames, errors = {}, {}
+
+        def join(ticker, live):
+            archived = self._archived(ticker, start, min(end, current), interval) if start < current else None
+            frames[ticker] = _join(archived, live)
+            if on_bars is not None:
+                on_bars(ticker, frames[ticker])
+
+        if end < current:
+            for ticker in tickers:
+                join(ticker, None)
+        elif len(tickers) == 1:
+            join(tickers[0], self.source.history(tickers[0], max(start, current), end, interval))
+        else:
+            # A ticker whose live bars failed fails as a whole; its archived
+            # bars alone would pass for an up-to-date history
+            try:
+                self.source.history_many(tickers, max(start, current), end, interval, join)
+            except PartialHistory as e:
+                errors = e.errors
+        if errors:
+            raise PartialHistory(frames, errors)
+        return frames
+
+    def _dir(self, ticker, interval):
+        return os.path.join(self.root, ticker.upper(), interval)
+
+    def _archived(self, ticker, start, end, interval):
+        freq = PARTITIONS.get(interval, 'D')
+        periods = pd.period_range(start.tz_localize(None), end.tz_localize(None), freq=freq)
+        periods = [p for p in periods if p.start_time < end.tz_localize(None)]
+        stored = set(os.listdir(self._dir(ticker, interval))) if os.path.isdir(self._dir(ticker, interval)) else set()
+        missing = [p for p in periods if f"{p}.npy" not in stored]
+
+        # Yahoo only serves intraday bars this many days back
+        retention = RETENTION_DAYS.get(interval)
+        if retention is not None:
+            oldest = pd.Timestamp.now(tz='US/Eastern').normalize() - pd.Timedelta(days=retention - 1)
+            missing = [p for p in missing if _period_start(p) >= oldest]
+        if missing:
+            self._backfill(ticker, interval, missing)
+
+        records = [self._load(ticker, interval, p) for p in periods]
+        records = [r for r in records if r is not None and len(r)]
+        if not records:
+            return _empty()
+        records = np.concatenate(records)
+        meta = self._meta(ticker, interval)
+        packed = {'time': records['time'], 'tz': meta.get('tz'), 'name': meta.get('name')}
+        for name in BAR_COLUMNS:
+            packed[name] = records[name]
+        return unpack(packed, start, end)
+
+    def _backfill(self, ticker, interval, missing):
+        first, last = missing[0], missing[-1]
+        bars = self.source.history(ticker, _period_start(first), _period_start(last + 1), interval)
+        if bars.empty:
+            # Nothing at all may be a rate limit rather than a holiday; only
+            # weekend days are safe to record as days without bars
+            missing = [p for p in missing if p.freqstr == 'D' and p.weekday >= 5]
+        else:
+            self._write_meta(ticker, interval, bars)
+
+        packed = pack(bars)
+        records = np.empty(len(packed['time']), dtype=BAR_DTYPE)
+        records['time'] = packed['time']
+        for name in BAR_COLUMNS:
+            records[name] = packed.get(name, 0)
+
+        # Partition by the Eastern wall-clock time of each bar
+        index = pd.DatetimeIndex(bars.index)
+        if index.tz is not None:
+            index = index.tz_convert('US/Eastern').tz_localize(None)
+        periods = index.to_period(first.freq)
+        for period in missing:
+            self._save(ticker, interval, period, records[periods == period])
+
+    def _path(self, ticker, interval, period):
+        return os.path.join(self._dir(ticker, interval), f"{period}.npy")
+
+    def _save(self, ticker, interval, period, records):
+        path = self._path(ticker, interval, period)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written under a temporary name and renamed, so other workers never
+        # read a half-written file
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, records)
+        os.replace(tmp, path)
+
+    def _load(self, ticker, interval, period):
+        try:
+            return np.load(self._path(ticker, interval, period), mmap_mode='r')
+        except FileNotFoundError:
+            return None
+        except ValueError:  # an empty period can't be memory-mapped
+            return np.load(self._path(ticker, interval, period))
+
+    def _meta(self, ticker, interval):
+        path = os.path.join(self._dir(ticker, interval), 'meta.json')
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+    def _write_meta(self, ticker, interval, bars):
+        index = pd.DatetimeIndex(bars.index)
+        meta = {'tz': None if index.tz is None else str(index.tz), 'name': index.name}
+        if meta == self._meta(ticker, interval):
+            return
+        os.makedirs(self._dir(ticker, interval), exist_ok=True)
+        with open(os.path.join(self._dir(ticker, interval), 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+
+# First moment of a period, in US/Eastern
+def _period_start(period):
+    return period.start_time.tz_localize('US/Eastern')
+
+
+# Archived bars followed by the live ones; either may be missing
+def _join(archived, live):
+    if archived is None or archived.empty:
+        return live if live is not None else archived
+    if live is None or live.empty:
+        return archived
+    bars = pd.concat([archived, live])
+    return bars[~bars.index.duplicated(keep='last')]
+
+
+def _empty():
+    return pd.DataFrame(columns=list(BAR_COLUMNS))
+
+
+# The archive configured by JJAI_ARCHIVE_PATH, or None with JJAI_ARCHIVE=0
+def make_archive(source, root=None):
+    if os.environ.get('JJAI_ARCHIVE', '1') == '0':
+        return None
+    root = root or os.environ.get('JJAI_ARCHIVE_PATH') or os.path.join(private_dir(), 'archive')
+    return BarArchive(source, root)
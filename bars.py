@@ -0,0 +1,247 @@
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from cache import bar_aligned_ttl, make_key
+
+# How far back bars are kept per interval (Yahoo's own intraday limits)
+RETENTION_DAYS = {'1m': 7, '5m': 60, '15m': 60, '30m': 60, '1h': 730}
+
+# Bar columns kept in the cache and how they are stored; Dividends and Stock
+# Splits are dropped. Times are stored as uint32 epoch seconds.
+BAR_COLUMNS = {
+    'Open': 'float32',
+    'High': 'float32',
+    'Low': 'float32',
+    'Close': 'float32',
+    'Volume': 'uint32',
+}
+
+# Raised by history_many when some tickers failed: `bars` holds what the
+# others got, `errors` the exception of each ticker that failed
+class PartialHistory(Exception):
+    def __init__(self, bars, errors):
+        super().__init__('; '.join(f"{ticker}: {error}" for ticker, error in errors.items()))
+        self.bars = bars
+        self.errors = errors
+
+
+# Bars older than a stored window are only fetched when first needed; after
+# that every refresh asks upstream for the bars since the last stored one
+# (re-fetching that bar since it may still have been forming) and merges them.
+class BarStore:
+    def __init__(self, source, cache):
+        self.source = source
+        self.cache = cache
+
+    @staticmethod
+    def key(ticker, interval):
+        return make_key(ticker.upper(), interval)
+
+    def history(self, ticker, start, end, interval='5m', refresh=False):
+        key = self.key(ticker, interval)
+        start = _eastern(start)
+        end = _eastern(end)
+
+        entry = None if refresh else self.cache.get('bars', key)
+        if entry is None or entry['since'] > start:
+            # One update per ticker and interval at a time; a caller that shared
+            # an update for a shorter window than it needs runs its own after it
+            load = lambda: self._load(ticker, start, end, interval, refresh)
+            try:
+                entry = self.cache.single_flight('bars', key, load)
+                if entry['since'] > start:
+                    entry = self.cache.single_flight('bars', key, load)
+            except Exception as e:
+                # Upstream failing: serve the last bars stored, however old
+                entry = None if refresh else self.cache.get_stale('bars', key)
+                if entry is None:
+                    raise
+                print(f"Serving stale bars {key}: {e}")
+
+        return unpack(entry['bars'], start, end)
+
+    def _load(self, ticker, start, end, interval, refresh):
+        key = self.key(ticker, interval)
+        # Another worker may have updated it while this one waited for the lease
+        entry = None if refresh else self.cache.peek('bars', key)
+        if entry is None or entry['since'] > start:
+            stored = entry or self.cache.get_stale('bars', key)
+            if stored is not None:
+                stored = {'since': stored['since'], 'bars': unpack(stored['bars'])}
+            entry = self._update(ticker, start, end, interval, stored)
+            entry = {'since': entry['since'], 'bars': pack(entry['bars'])}
+            self.cache.set('bars', key, entry, bar_aligned_ttl(interval))
+        return entry
+
+    # Several tickers over one window, with one coalesced fan-out (a request
+    # per ticker, in parallel) for the ones that need updating. The batch is
+    # single-flighted under its own key, so the mini-chart row and the
+    # prefetcher asking together share it.
+    def history_many(self, tickers, start, end, interval='5m', refresh=False):
+        start = _eastern(start)
+        end = _eastern(end)
+
+        entries = {}
+        for ticker in tickers:
+            entry = None if refresh else self.cache.get('bars', self.key(ticker, interval))
+            if entry is not None and entry['since'] <= start:
+                entries[ticker] = entry
+        missing = [t for t in tickers if t not in entries]
+        errors = {}
+        if missing:
+            key = make_key(','.join(sorted(t.upper() for t in missing)), interval)
+            load = lambda: self._load_many(missing, start, end, interval, refresh)
+            try:
+                loaded = self.cache.single_flight('bars', key, load)
+                if any(entry['since'] > start for entry in loaded.values()):
+                    loaded = self.cache.single_flight('bars', key, load)
+            except Exception as e:
+                # Upstream failing for some or all of them: serve the last bars
+                # stored for those, however old
+                partial = isinstance(e, PartialHistory)
+                loaded = dict(e.bars) if partial else {}
+                for ticker, error in (e.errors if partial else dict.fromkeys(missing, e)).items():
+                    entry = None if refresh else self.cache.get_stale('bars', self.key(ticker, interval))
+                    if entry is None:
+                        errors[ticker] = error
+                        continue
+                    print(f"Serving stale bars {self.key(ticker, interval)}: {error}")
+                    loaded[ticker] = entry
+            entries.update(loaded)
+
+        bars = {ticker: unpack(entries[ticker]['bars'], start, end) for ticker in tickers if ticker in entries}
+        if errors:
+            raise PartialHistory(bars, errors)
+        return bars
+
+    # The bars stored for a ticker however old, without asking upstream
+    def stored(self, ticker, start, end, interval='5m'):
+        entry = self.cache.get_stale('bars', self.key(ticker, interval))
+        return None if entry is None else unpack(entry['bars'], _eastern(start), _eastern(end))
+
+    def _load_many(self, tickers, start, end, interval, refresh):
+        entries, stored = {}, {}
+        for ticker in tickers:
+            entry = None if refresh else self.cache.peek('bars', self.key(ticker, interval))
+            if entry is not None and entry['since'] <= start:
+                entries[ticker] = entry
+                continue
+            entry = entry or self.cache.get_stale('bars', self.key(ticker, interval))
+            stored[ticker] = None if entry is None else {'since': entry['since'], 'bars': unpack(entry['bars'])}
+        if not stored:
+            return entries
+
+        # One window covering every ticker's update; the overlap with bars
+        # already stored is merged away
+        fetch_from = min(_eastern(self._fetch_from(s, start)) for s in stored.values())
+        # Each ticker is stored as soon as its bars are in, so a slow one
+        # doesn't hold back the others for readers of the cache
+        def store(ticker, new_bars):
+            entry = self._merge(stored[ticker], new_bars, start, end, interval)
+            entry = {'since': entry['since'], 'bars': pack(entry['bars'])}
+            self.cache.set('bars', self.key(ticker, interval), entry, bar_aligned_ttl(interval))
+            entries[ticker] = entry
+
+        try:
+            self.source.history_many(list(stored), fetch_from, end, interval, store)
+            errors = {}
+        except PartialHistory as e:
+            errors = e.errors
+        # The failed ones keep what they had, to be served stale
+        if errors:
+            raise PartialHistory(entries, errors)
+        return entries
+
+    def _update(self, ticker, start, end, interval, stored):
+        new_bars = self.source.history(ticker, self._fetch_from(stored, start), end, interval)
+        return self._merge(stored, new_bars, start, end, interval)
+
+    # First bar upstream has to send: all of the window without usable stored
+    # bars, else from the last stored one
+    @staticmethod
+    def _fetch_from(stored, start):
+        if stored is None or stored['since'] > start or stored['bars'].empty:
+            return start
+        return stored['bars'].index[-1]
+
+    def _merge(self, stored, new_bars, start, end, interval):
+        if stored is None or stored['since'] > start or stored['bars'].empty:
+            return {'since': start, 'bars': new_bars}
+
+        bars = stored['bars']
+        if not new_bars.empty:
+            bars = pd.concat([bars, new_bars])
+            bars = bars[~bars.index.duplicated(keep='last')].sort_index()
+
+        since = stored['since']
+        retention = RETENTION_DAYS.get(interval)
+        if retention is not None:
+            cutoff = end - timedelta(days=retention)
+            if since < cutoff:
+                since = cutoff
+                bars = bars[bars.index >= _align(cutoff, bars.index)]
+        return {'since': since, 'bars': bars}
+
+
+# Bars as compact column arrays: about 24 bytes per bar instead of 64
+def pack(bars):
+    index = pd.DatetimeIndex(bars.index)
+    packed = {
+        'time': index.as_unit('s').asi8.astype('uint32'),
+        'tz': None if index.tz is None else str(index.tz),
+        'name': index.name,
+    }
+    for name, dtype in BAR_COLUMNS.items():
+        if name in bars:
+            values = bars[name].to_numpy(dtype=float, na_value=np.nan)
+            if dtype == 'uint32':
+                values = np.clip(np.nan_to_num(values), 0, np.iinfo(np.uint32).max)
+            packed[name] = values.astype(dtype)
+    return packed
+
+
+# The packed bars between start and end (all of them by default) as a frame
+def unpack(packed, start=None, end=None):
+    if isinstance(packed, pd.DataFrame):  # written by an older version of the app
+        return packed if start is None else _slice(packed, start, end)
+    times = packed['time']
+    lo, hi = 0, len(times)
+    if start is not None:
+        lo = np.searchsorted(times, _epoch(start, packed['tz']), side='left')
+        hi = np.searchsorted(times, _epoch(end, packed['tz']), side='right')
+    index = pd.to_datetime(times[lo:hi].astype('int64'), unit='s', utc=True)
+    index = index.tz_convert(packed['tz']) if packed['tz'] else index.tz_localize(None)
+    columns = {
+        name: packed[name][lo:hi].astype('int64' if dtype == 'uint32' else 'float64')
+        for name, dtype in BAR_COLUMNS.items() if name in packed
+    }
+    return pd.DataFrame(columns, index=index.rename(packed['name']))
+
+
+# Naive bar times are wall-clock times, stored as if they were UTC
+def _epoch(ts, tz):
+    ts = pd.Timestamp(ts)
+    if tz is None and ts.tzinfo is not None:
+        ts = ts.tz_localize(None)
+    return ts.timestamp()
+
+
+# Naive times are taken to be US/Eastern, like everywhere else in the app
+def _eastern(ts):
+    ts = pd.Timestamp(ts)
+    return ts.tz_localize('US/Eastern') if ts.tzinfo is None else ts
+
+
+def _align(ts, index):
+    if getattr(index, 'tz', None) is None:
+        return ts.tz_localize(None) if ts.tzinfo is not None else ts
+    return ts.tz_localize(index.tz) if ts.tzinfo is None else ts.tz_convert(index.tz)
+
+
+def _slice(bars, start, end):
+    if bars.empty:
+        return bars
+    index = bars.index
+    return bars[(index >= _align(start, index)) & (index <= _align(end, index))]
@@ -0,0 +1,315 @@
+"""Benchmark the dashboard hot paths against recorded market data.
+
+    python bench.py --synthesize fixtures-bench      # deterministic fake market
+    python bench.py --fixtures fixtures-bench        # run, save bench_results/*.json
+    python bench.py --fixtures fixtures-bench --compare bench_results/<old>.json
+
+Fixtures can also be recorded from Yahoo with JJAI_DATA_PROVIDER=record.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import resource
+import threading
+import subprocess
+import tracemalloc
+import urllib.request
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytz
+
+EASTERN = pytz.timezone('US/Eastern')
+
+# Scenario tickers: a SPY-sized chain and a small one
+BIG_TICKER = 'SPY'
+SMALL_TICKER = 'XYZ'
+INDEX_TICKERS = ['QQQ', 'SPY', 'IWM', 'DIA']
+
+# (interval, days) windows recorded per ticker: the widest window per bar
+# interval of the main chart, the mini-charts, live ticks and the scheduler
+HISTORY_WINDOWS = [('1h', 1), ('5m', 1), ('5m', 28), ('1h', 182), ('1d', 365)]
+
+
+# Deterministic fake market written through RecordingProvider, so the files
+# have exactly the layout of a real recording
+def synthesize(root):
+    from chains import ChainSnapshot
+    from providers import MarketDataProvider, RecordingProvider
+
+    today = pd.Timestamp.now(tz='US/Eastern').normalize().tz_localize(None)
+    fridays = [d for d in pd.date_range(today, periods=120) if d.weekday() == 4]
+    rng = np.random.default_rng(42)
+
+    class Synthetic(MarketDataProvider):
+        def history(self, ticker, start, end, interval='5m'):
+            step = {'5m': '5min', '1h': '1h', '1d': '1D'}[interval]
+            index = pd.date_range(pd.Timestamp(start).floor(step), pd.Timestamp(end), freq=step, tz='US/Eastern')
+            minutes = index.hour * 60 + index.minute
+            if interval != '1d':
+                index = index[(minutes >= 9 * 60 + 30) & (minutes < 16 * 60)]
+            index = index[index.weekday < 5]
+            close = 100 * np.exp(np.cumsum(rng.normal(0, 0.001, len(index))))
+            return pd.DataFrame({
+                'Open': close * (1 + rng.normal(0, 0.0005, len(index))),
+                'High': close * 1.001,
+                'Low': close * 0.999,
+                'Close': close,
+                'Volume': rng.integers(1000, 100000, len(index)),
+                'Dividends': 0.0,
+                'Stock Splits': 0.0,
+            }, index=index.rename('Datetime'))
+
+        def option_chain(self, ticker, expiration_date):
+            count = 400 if ticker == BIG_TICKER else 40
+            strikes = np.round(np.linspace(50, 150, count), 1)
+
+            def side():
+                return pd.DataFrame({
+                    'contractSymbol': [f"{ticker}{expiration_date}{k}" for k in strikes],
+                    'strike': strikes,
+                    'lastPrice': rng.uniform(0.05, 20, count),
+                    'volume': rng.integers(0, 5000, count).astype(float),
+                    'openInterest': rng.integers(0, 50000, count),
+                    'impliedVolatility': rng.uniform(0.1, 0.6, count),
+                    'inTheMoney': False,
+                    'currency': 'USD',
+                })
+            return ChainSnapshot.from_frames(side(), side(), expiration_date)
+
+        def expirations(self, ticker):
+            count = 30 if ticker == BIG_TICKER else 4
+            return [d.strftime('%Y-%m-%d') for d in fridays[:count]]
+
+    recorder = RecordingProvider(Synthetic(), root)
+    end = datetime.now(EASTERN)
+    for ticker in sorted(set(INDEX_TICKERS + [BIG_TICKER, SMALL_TICKER])):
+        for interval, days in HISTORY_WINDOWS:
+            recorder.history(ticker, end - timedelta(days=days), end, interval)
+        for expiration_date in recorder.expirations(ticker):
+            recorder.option_chain(ticker, expiration_date)
+    print(f"Synthetic fixtures written to {root}")
+
+
+def percentile(samples, q):
+    return float(np.percentile(samples, q)) if samples else None
+
+
+def summarize(latencies, sizes):
+    return {
+        'n': len(latencies),
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'max_ms': max(latencies) if latencies else None,
+        'payload_bytes': int(np.median(sizes)) if sizes else None,
+    }
+
+
+# Request body of the update_charts callback, as the browser would send it
+# when the ticker is entered (the time filters never reach the server)
+def update_charts_body(ticker, aggregate):
+    inputs = [
+        ('symbol-input', 'value', ticker),
+        ('expiration-date-picker', 'date', datetime.now(EASTERN).strftime('%Y-%m-%d')),
+        ('aggregate-toggle', 'value', ['all'] if aggregate else []),
+    ]
+    output_ids = [('options-graph', 'figure'), ('live-state', 'data')]
+    return {
+        'output': '..options-graph.figure...live-state.data..',
+        'outputs': [{'id': i, 'property': p} for i, p in output_ids],
+        'inputs': [{'id': i, 'property': p, 'value': v} for i, p, v in inputs],
+        'state': [{'id': 'chart-window', 'property': 'data', 'value': '1D'}],
+        'changedPropIds': ['symbol-input.value'],
+    }
+
+
+# update_charts through the Flask test client: callback plus serialization
+def bench_callbacks(JJAI, iterations):
+    client = JJAI.server.test_client()
+    results = {}
+    for ticker, size in ((BIG_TICKER, 'big'), (SMALL_TICKER, 'small')):
+        for aggregate in (False, True):
+            name = f"update_charts {size}{' all-expirations' if aggregate else ''}"
+            body = update_charts_body(ticker, aggregate)
+            JJAI.provider.cache.clear()
+
+            tracemalloc.start()
+            started = time.perf_counter()
+            response = client.post('/_dash-update-component', json=body)
+            cold_ms = (time.perf_counter() - started) * 1000
+            assert response.status_code == 200, response.data[:500]
+
+            latencies, sizes = [], []
+            for _ in range(iterations):
+                started = time.perf_counter()
+                response = client.post('/_dash-update-component', json=body)
+                latencies.append((time.perf_counter() - started) * 1000)
+                sizes.append(len(response.data))
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            results[name] = dict(summarize(latencies, sizes), cold_ms=cold_ms, peak_alloc_bytes=peak)
+            print(f"{name:45s} cold {cold_ms:8.1f} ms  p50 {results[name]['p50_ms']:7.1f} ms  "
+                  f"p95 {results[name]['p95_ms']:7.1f} ms  {results[name]['payload_bytes']:>8} B")
+    return results
+
+
+# Cache footprint of a ticker: a month of 5m bars plus every listed chain
+def cache_bytes_per_ticker(provider, tickers):
+    cache = provider.cache
+    cache.clear()
+    end = datetime.now(EASTERN)
+    for ticker in tickers:
+        provider.history(ticker, end - timedelta(days=28), end, '5m')
+        for expiration_date in provider.expirations(ticker):
+            provider.option_chain(ticker, expiration_date)
+    sizes = {kind: cache.entry_sizes(kind) for kind in ('bars', 'chain')}
+    footprint = {}
+    for ticker in tickers:
+        footprint[ticker] = {
+            kind: sum(size for key, size in entries.items() if key.startswith(f"{ticker}|"))
+            for kind, entries in sizes.items()
+        }
+        print(f"cache footprint {ticker:5s} bars {footprint[ticker]['bars']:>9} B  "
+              f"chains {footprint[ticker]['chain']:>9} B")
+    return footprint
+
+
+# GET url, or POST body as JSON when given; returns (ms, response bytes)
+def _request(url, body=None):
+    data = None if body is None else json.dumps(body).encode()
+    request = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
+    started = time.perf_counter()
+    with urllib.request.urlopen(request) as response:
+        size = len(response.read())
+    return (time.perf_counter() - started) * 1000, size
+
+
+# Concurrent users over real HTTP against a threaded server
+def bench_http(JJAI, users, requests_per_user):
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server('127.0.0.1', 0, JJAI.server, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+
+    requests = {
+        'levels': (f"/api/levels/{BIG_TICKER}", None),
+        'bars': (f"/api/bars/{BIG_TICKER}?days=28", None),
+        'minis': ('/api/minis/figures', None),
+        'update_charts big': ('/_dash-update-component', update_charts_body(BIG_TICKER, False)),
+        'update_charts small': ('/_dash-update-component', update_charts_body(SMALL_TICKER, False)),
+    }
+    results = {}
+    try:
+        for name, (path, body) in requests.items():
+            _request(base + path, body)  # warm
+            latencies, sizes = [], []
+            lock = threading.Lock()
+
+            def user():
+                for _ in range(requests_per_user):
+                    elapsed, size = _request(base + path, body)
+                    with lock:
+                        latencies.append(elapsed)
+                        sizes.append(size)
+
+            started = time.perf_counter()
+            threads = [threading.Thread(target=user) for _ in range(users)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            seconds = time.perf_counter() - started
+
+            key = f"http {name} x{users} users"
+            results[key] = dict(summarize(latencies, sizes), requests_per_second=len(latencies) / seconds)
+            print(f"{key:45s} p50 {results[key]['p50_ms']:7.1f} ms  p95 {results[key]['p95_ms']:7.1f} ms  "
+                  f"{results[key]['requests_per_second']:7.1f} req/s")
+    finally:
+        server.shutdown()
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+    except Exception:
+        return None
+
+
+def compare(current, previous_path):
+    with open(previous_path) as f:
+        previous = json.load(f)['scenarios']
+    print(f"\nChange vs {previous_path} (p50 / p95):")
+    for name, result in current.items():
+        before = previous.get(name)
+        if not before:
+            continue
+        deltas = []
+        for field in ('p50_ms', 'p95_ms'):
+            if before.get(field):
+                deltas.append(f"{(result[field] - before[field]) / before[field] * 100:+6.1f}%")
+        print(f"  {name:45s} {' / '.join(deltas)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--synthesize', metavar='DIR', help="write synthetic fixtures to DIR and exit")
+    parser.add_argument('--fixtures', default='fixtures', help="recorded fixtures to replay")
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--users', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=10, help="requests per concurrent user")
+    parser.add_argument('--out', default='bench_results')
+    parser.add_argument('--compare', metavar='JSON', help="earlier result file to compare against")
+    args = parser.parse_args()
+
+    if args.synthesize:
+        synthesize(args.synthesize)
+        return
+
+    # Replay only, on a private cache, with nothing running in the background
+    workdir = tempfile.mkdtemp(prefix='jjai-bench-')
+    os.environ.update({
+        'JJAI_DATA_PROVIDER': 'replay',
+        'JJAI_FIXTURES': args.fixtures,
+        'JJAI_CACHE_PATH': os.path.join(workdir, 'cache.sqlite'),
+        'JJAI_PREFETCH': '0',
+    })
+    import JJAI
+
+    scenarios = {}
+    scenarios.update(bench_callbacks(JJAI, args.iterations))
+    footprint = cache_bytes_per_ticker(JJAI.provider, [BIG_TICKER, SMALL_TICKER])
+    scenarios.update(bench_http(JJAI, args.users, args.requests))
+
+    result = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'python': sys.version.split()[0],
+        'startup_seconds': JJAI.STARTUP_SECONDS,
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'cache_bytes_per_ticker': footprint,
+        'scenarios': scenarios,
+    }
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, f"{time.strftime('%Y%m%d-%H%M%S')}-{result['revision'] or 'local'}.json")
+    with open(path, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f"\nStartup {result['startup_seconds'] * 1000:.0f} ms, max RSS {result['max_rss_kb'] / 1024:.0f} MB")
+    print(f"Results saved to {path}")
+
+    if args.compare:
+        compare(scenarios, args.compare)
+
+
+if __name__ == '__main__':
+    main()
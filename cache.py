@@ -0,0 +1,369 @@
+import os
+import re
+import time
+import pickle
+import stat
+import sqlite3
+import getpass
+import tempfile
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from governor import UpstreamUnavailable, token_wait
+
+# Default time-to-live per kind of cached data, in seconds
+TTLS = {
+    'chain': 60,
+    'expirations': 3600,
+    'bars': 300,
+}
+
+_INTERVAL_SECONDS = {'m': 60, 'h': 3600, 'd': 86400, 'wk': 7 * 86400}
+
+# Yahoo publishes a bar a few seconds after it closes
+BAR_GRACE_SECONDS = 5
+
+# A worker loading an entry holds a lease on it for at most this long; others
+# poll for the result every LEASE_POLL_SECONDS instead of loading it as well,
+# for no longer than they would wait for an upstream token themselves
+LEASE_SECONDS = 30
+LEASE_POLL_SECONDS = 0.05
+
+# Hit/miss counts and LRU touches are kept in memory and written at most this
+# often (and before every write), so reads never take the SQLite write lock
+STATS_FLUSH_SECONDS = 5
+
+
+def interval_seconds(interval):
+    match = re.fullmatch(r'(\d+)(m|h|d|wk)', interval)
+    if not match:
+        raise ValueError(f"Unsupported interval: {interval}")
+    return int(match.group(1)) * _INTERVAL_SECONDS[match.group(2)]
+
+
+# Seconds until the next bar of the given interval closes, capped at the bars TTL
+def bar_aligned_ttl(interval, now=None):
+    now = time.time() if now is None else now
+    step = interval_seconds(interval)
+    remaining = step - (now % step) + BAR_GRACE_SECONDS
+    return min(remaining, TTLS['bars'])
+
+
+# Directory of this user's cache, lock and archive files, <tmp>/jjai-<user>,
+# open to this user only. Cached values are unpickled, so anything in it
+# that another user created first is refused rather than read.
+def private_dir():
+    user = os.getuid() if hasattr(os, 'getuid') else getpass.getuser()
+    path = os.path.join(tempfile.gettempdir(), f"jjai-{user}")
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    _check_owner(path, os.lstat(path))
+    if hasattr(os, 'getuid') and os.lstat(path).st_mode & 0o022:
+        raise PermissionError(f"{path} is writable by other users; refusing to use it")
+    return path
+
+
+# Create a file readable by this user only, or check that the existing one
+# belongs to this user
+def private_file(path):
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, 'O_NOFOLLOW', 0), 0o600)
+    try:
+        _check_owner(path, os.fstat(fd))
+    finally:
+        os.close(fd)
+
+
+def _check_owner(path, info):
+    if stat.S_ISLNK(info.st_mode) or (hasattr(os, 'getuid') and info.st_uid != os.getuid()):
+        raise PermissionError(f"{path} is not owned by this user; refusing to use it")
+
+
+def make_key(*parts):
+    return '|'.join('' if p is None else str(p) for p in parts)
+
+
+# Concurrent calls for the same key within this process run fn once; the
+# other callers wait and get its result (or its exception)
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    # Callers joining a call already running wait at most timeout seconds
+    # (concurrent.futures.TimeoutError past it)
+    def run(self, key, fn, timeout=None):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            return future.result(timeout)
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._calls[key]
+        return future.result()
+
+
+# TTL cache stored in a SQLite file so every gunicorn worker on the host shares it.
+# Entries are evicted least-recently-used once their total size exceeds the budget.
+class SharedCache:
+    def __init__(self, path, budget_bytes):
+        self.path = path
+        self.budget_bytes = budget_bytes
+        private_file(path)
+        self._local = threading.local()
+        self._flights = SingleFlight()
+        self._pending_lock = threading.Lock()
+        self._pending_counts = {}
+        self._pending_touches = {}
+        self._flushed_at = time.monotonic()
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    kind TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    expires_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    PRIMARY KEY (kind, key)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_lru ON entries (accessed_at)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS counters (
+                    kind TEXT PRIMARY KEY,
+                    hits INTEGER NOT NULL DEFAULT 0,
+                    misses INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS leases (
+                    kind TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    owner TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    PRIMARY KEY (kind, key)
+                )
+            """)
+
+    # One connection per thread; sqlite3 connections must not be shared across threads
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _record(self, kind, key, hit, now):
+        with self._pending_lock:
+            counts = self._pending_counts.setdefault(kind, [0, 0])
+            counts[0 if hit else 1] += 1
+            if hit:
+                self._pending_touches[(kind, key)] = now
+            due = time.monotonic() - self._flushed_at >= STATS_FLUSH_SECONDS
+        if due:
+            conn = self._connect()
+            with conn:
+                self._flush(conn)
+
+    # Write the pending counts and touches inside the caller's transaction
+    def _flush(self, conn):
+        with self._pending_lock:
+            counts, self._pending_counts = self._pending_counts, {}
+            touches, self._pending_touches = self._pending_touches, {}
+            self._flushed_at = time.monotonic()
+        for kind, (hits, misses) in counts.items():
+            conn.execute(
+                "INSERT INTO counters (kind, hits, misses) VALUES (?, ?, ?) "
+                "ON CONFLICT(kind) DO UPDATE SET hits = hits + excluded.hits, misses = misses + excluded.misses",
+                (kind, hits, misses),
+            )
+        conn.executemany(
+            "UPDATE entries SET accessed_at = MAX(accessed_at, ?) WHERE kind = ? AND key = ?",
+            [(at, kind, key) for (kind, key), at in touches.items()],
+        )
+
+    # Return the cached value, or None when it is missing or expired
+    def get(self, kind, key):
+        conn = self._connect()
+        now = time.time()
+        row = conn.execute(
+            "SELECT value, expires_at FROM entries WHERE kind = ? AND key = ?", (kind, key)
+        ).fetchone()
+        value = None
+        if row is not None and row[1] > now:
+            try:
+                value = pickle.loads(row[0])
+            except Exception:
+                # Written by an older version of the app; treat as a miss
+                value = None
+        self._record(kind, key, value is not None, now)
+        return value
+
+    # Unexpired value without touching the hit/miss counters or LRU order
+    def peek(self, kind, key):
+        row = self._connect().execute(
+            "SELECT value FROM entries WHERE kind = ? AND key = ? AND expires_at > ?",
+            (kind, key, time.time()),
+        ).fetchone()
+        if row is None:
+            return None
+        try:
+            return pickle.loads(row[0])
+        except Exception:
+            return None
+
+    # Return the value even if it has expired (not counted as a hit or miss)
+    def get_stale(self, kind, key):
+        row = self._connect().execute(
+            "SELECT value FROM entries WHERE kind = ? AND key = ?", (kind, key)
+        ).fetchone()
+        if row is None:
+            return None
+        try:
+            return pickle.loads(row[0])
+        except Exception:
+            return None
+
+    # Seconds until the entry expires (negative once expired), None when absent
+    def expires_in(self, kind, key):
+        row = self._connect().execute(
+            "SELECT expires_at FROM entries WHERE kind = ? AND key = ?", (kind, key)
+        ).fetchone()
+        return None if row is None else row[0] - time.time()
+
+    def set(self, kind, key, value, ttl):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (kind, key, value, size, expires_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (kind, key, blob, len(blob), now + ttl, now),
+            )
+            self._flush(conn)
+            self._evict(conn)
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.budget_bytes:
+            return
+        for kind, key, size in conn.execute(
+            "SELECT kind, key, size FROM entries ORDER BY accessed_at"
+        ).fetchall():
+            conn.execute("DELETE FROM entries WHERE kind = ? AND key = ?", (kind, key))
+            total -= size
+            if total <= self.budget_bytes:
+                break
+
+    # Return the cached value, computing and storing it on a miss (or always,
+    # with refresh=True). Concurrent misses for the same entry, in this process
+    # or any other sharing the file, call loader only once.
+    def get_or_load(self, kind, key, loader, ttl, refresh=False):
+        value = None if refresh else self.get(kind, key)
+        if value is None:
+            value = self.single_flight(kind, key, lambda: self._load(kind, key, loader, ttl, refresh))
+        return value
+
+    def _load(self, kind, key, loader, ttl, refresh):
+        # Another worker may have stored it while this one waited for the lease
+        value = None if refresh else self.peek(kind, key)
+        if value is None:
+            value = loader()
+            self.set(kind, key, value, ttl() if callable(ttl) else ttl)
+        return value
+
+    # Run load() for an entry at most once at a time: threads of this process
+    # share one call, and across processes a lease in the file serializes the
+    # calls, so load() should first look for what the previous holder stored.
+    # Waiting for another caller's load (a bulk job may queue for minutes) is
+    # capped at this caller's own token_wait(), then UpstreamUnavailable is
+    # raised so it can serve what is stale instead
+    def single_flight(self, kind, key, load):
+        wait = token_wait()
+        try:
+            return self._flights.run((kind, key), lambda: self._under_lease(kind, key, load, wait), wait)
+        except FutureTimeout:
+            raise UpstreamUnavailable(f"still loading {kind} {key}") from None
+
+    def _under_lease(self, kind, key, load, wait):
+        owner = f"{os.getpid()}-{threading.get_ident()}"
+        deadline = time.time() + wait
+        acquired = self._acquire_lease(kind, key, owner)
+        while not acquired and time.time() < deadline:
+            time.sleep(LEASE_POLL_SECONDS)
+            acquired = self._acquire_lease(kind, key, owner)
+        # A holder that died leaves its lease to expire after LEASE_SECONDS
+        if not acquired:
+            raise UpstreamUnavailable(f"{kind} {key} is being loaded by another worker")
+        try:
+            return load()
+        finally:
+            self._release_lease(kind, key, owner)
+
+    def _acquire_lease(self, kind, key, owner):
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "DELETE FROM leases WHERE kind = ? AND key = ? AND expires_at <= ?", (kind, key, now)
+            )
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO leases (kind, key, owner, expires_at) VALUES (?, ?, ?, ?)",
+                (kind, key, owner, now + LEASE_SECONDS),
+            )
+        return cursor.rowcount == 1
+
+    def _release_lease(self, kind, key, owner):
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "DELETE FROM leases WHERE kind = ? AND key = ? AND owner = ?", (kind, key, owner)
+            )
+
+    # Hit/miss counters summed over every worker sharing the cache file
+    def stats(self):
+        conn = self._connect()
+        with conn:
+            self._flush(conn)
+        counters = {
+            kind: {'hits': hits, 'misses': misses}
+            for kind, hits, misses in conn.execute("SELECT kind, hits, misses FROM counters")
+        }
+        entries, size = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()
+        return {
+            'counters': counters,
+            'entries': entries,
+            'bytes': size,
+            'budget_bytes': self.budget_bytes,
+        }
+
+    # Stored size in bytes of every entry of one kind, by key
+    def entry_sizes(self, kind):
+        rows = self._connect().execute("SELECT key, size FROM entries WHERE kind = ?", (kind,))
+        return dict(rows.fetchall())
+
+    def clear(self):
+        conn = self._connect()
+        with conn:
+            self._flush(conn)
+            conn.execute("DELETE FROM entries")
+            conn.execute("DELETE FROM counters")
+            conn.execute("DELETE FROM leases")
+
+
+# Build the shared cache configured by JJAI_CACHE_PATH and JJAI_CACHE_MB
+def make_cache(path=None, budget_mb=None):
+    path = path or os.environ.get('JJAI_CACHE_PATH') or os.path.join(private_dir(), 'cache.sqlite')
+    budget_mb = budget_mb or float(os.environ.get('JJAI_CACHE_MB', 256))
+    return SharedCache(path, int(budget_mb * 1024 * 1024))
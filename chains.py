@@ -0,0 +1,124 @@
+import os
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# Option chain columns the dashboard reads and how they are stored; everything
+# else is dropped. float32 holds open interest and volume exactly up to 16M.
+CHAIN_COLUMNS = {
+    'strike': 'float64',
+    'openInterest': 'float32',
+    'volume': 'float32',
+    'impliedVolatility': 'float32',
+    'lastPrice': 'float32',
+}
+
+# Most option chains downloaded at the same time for one request
+CHAIN_WORKERS = int(os.environ.get('JJAI_CHAIN_WORKERS', 4))
+
+_chain_pool = ThreadPoolExecutor(max_workers=CHAIN_WORKERS, thread_name_prefix='chain')
+
+
+# Calls and puts of one expiration downloaded together and held as flat
+# column arrays, with `is_call` telling the two sides apart. One snapshot
+# serves OI levels, volume levels and any further analytics.
+class ChainSnapshot:
+    def __init__(self, columns, is_call, expiration=None):
+        self.columns = columns
+        self.is_call = is_call
+        self.expiration = expiration
+
+    @classmethod
+    def from_frames(cls, calls, puts, expiration=None):
+        columns = {}
+        for name, dtype in CHAIN_COLUMNS.items():
+            columns[name] = np.concatenate([
+                _column(calls, name, dtype),
+                _column(puts, name, dtype),
+            ])
+        is_call = np.concatenate([
+            np.ones(len(calls), dtype=bool),
+            np.zeros(len(puts), dtype=bool),
+        ])
+        return cls(columns, is_call, expiration)
+
+    # Several expirations summed per (strike, side); implied vol and price,
+    # which don't add up across expirations, become NaN
+    @classmethod
+    def merge(cls, snapshots):
+        if len(snapshots) == 1:
+            return snapshots[0]
+        strike = np.concatenate([s.columns['strike'] for s in snapshots])
+        is_call = np.concatenate([s.is_call for s in snapshots])
+        keys, position = np.unique(np.column_stack([strike, is_call]), axis=0, return_inverse=True)
+        position = position.ravel()
+        columns = {name: np.full(len(keys), np.nan, dtype=dtype) for name, dtype in CHAIN_COLUMNS.items()}
+        columns['strike'] = keys[:, 0]
+        for name in ('openInterest', 'volume'):
+            values = np.nan_to_num(np.concatenate([s.columns[name] for s in snapshots], dtype=float))
+            columns[name] = np.bincount(position, weights=values, minlength=len(keys))
+        return cls(columns, keys[:, 1].astype(bool))
+
+    def __len__(self):
+        return len(self.is_call)
+
+    def _mask(self, side):
+        if side == 'calls':
+            return self.is_call
+        if side == 'puts':
+            return ~self.is_call
+        raise ValueError(f"Unknown chain side: {side}")
+
+    def frame(self, side):
+        mask = self._mask(side)
+        return pd.DataFrame({name: values[mask] for name, values in self.columns.items()})
+
+    @property
+    def calls(self):
+        return self.frame('calls')
+
+    @property
+    def puts(self):
+        return self.frame('puts')
+
+    # Same result as frame(side).nlargest(n, column)[['strike', column]]
+    def top(self, side, column, n=5):
+        mask = self._mask(side)
+        values = self.columns[column][mask]
+        valid = np.flatnonzero(~np.isnan(values))
+        order = valid[np.argsort(-values[valid], kind='stable')[:n]]
+        return pd.DataFrame(
+            {'strike': self.columns['strike'][mask][order], column: values[order]},
+            index=order,
+        )
+
+
+def _column(frame, name, dtype):
+    if name not in frame:
+        return np.full(len(frame), np.nan, dtype=dtype)
+    return frame[name].to_numpy(dtype=float, na_value=np.nan).astype(dtype)
+
+
+# Listed expiration closest to the requested date (the date itself if listed)
+def snap_expiration(expirations, date):
+    if not expirations or date in expirations:
+        return date
+    target = pd.Timestamp(date)
+    return min(expirations, key=lambda e: (abs(pd.Timestamp(e) - target), -pd.Timestamp(e).value))
+
+
+# Listed expirations from today up to `horizon_days` ahead
+def expirations_within(expirations, horizon_days, today=None):
+    today = pd.Timestamp(today or pd.Timestamp.now(tz='US/Eastern').date())
+    last = today + pd.Timedelta(days=horizon_days)
+    return [e for e in expirations if today <= pd.Timestamp(e) <= last]
+
+
+# Download the chains of several expirations in parallel, at most
+# CHAIN_WORKERS at a time across all requests of this process. Each download
+# runs in a copy of the caller's context, so it keeps its upstream wait budget.
+def fetch_chains(provider, ticker, expirations):
+    context = contextvars.copy_context()
+    return list(_chain_pool.map(lambda e: context.copy().run(provider.option_chain, ticker, e), expirations))
@@ -0,0 +1,46 @@
+import os
+
+import numpy as np
+
+# Most points sent to the browser per line, about the plot width in pixels
+MAX_POINTS = int(os.environ.get('JJAI_MAX_POINTS', 1200))
+
+
+# Largest-Triangle-Three-Buckets: positions of `threshold` points that keep
+# the visual shape of the line. The first and last points are always kept.
+def lttb_indices(x, y, threshold):
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    every = (n - 2) / (threshold - 2)
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = n - 1
+    a = 0
+    for i in range(threshold - 2):
+        lo = int(i * every) + 1
+        hi = int((i + 1) * every) + 1
+        next_hi = min(int((i + 2) * every) + 1, n)
+        if hi < next_hi:
+            avg_x = x[hi:next_hi].mean()
+            avg_y = y[hi:next_hi].mean()
+        else:
+            avg_x, avg_y = x[n - 1], y[n - 1]
+        area = np.abs(
+            (x[a] - avg_x) * (y[lo:hi] - y[a])
+            - (x[a] - x[lo:hi]) * (avg_y - y[a])
+        )
+        a = lo + int(np.argmax(area))
+        indices[i + 1] = a
+    return indices
+
+
+# Rows of a time-indexed frame thinned to at most `threshold`, following `column`
+def downsample(data, column='Close', threshold=MAX_POINTS):
+    data = data[data[column].notna()]
+    if len(data) <= threshold:
+        return data
+    x = (data.index - data.index[0]).total_seconds().to_numpy()
+    y = data[column].to_numpy(dtype=float)
+    return data.iloc[lttb_indices(x, y, threshold)]
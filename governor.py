@@ -0,0 +1,158 @@
+import os
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+from metrics import set_gauge
+
+# Sustained Yahoo requests per second per process, and the burst allowed on top
+UPSTREAM_RATE = float(os.environ.get('JJAI_UPSTREAM_RATE', 4))
+UPSTREAM_BURST = int(os.environ.get('JJAI_UPSTREAM_BURST', 10))
+
+# Longest a request waits for a token before giving up on upstream
+TOKEN_WAIT_SECONDS = float(os.environ.get('JJAI_TOKEN_WAIT_SECONDS', 2))
+
+# The same for bulk jobs (the scanner and the prefetcher), which queue on the
+# bucket at its rate instead of failing once the burst is spent
+BULK_TOKEN_WAIT_SECONDS = float(os.environ.get('JJAI_BULK_TOKEN_WAIT_SECONDS', 600))
+
+# Consecutive upstream failures that open the breaker, and how long it stays
+# open before one trial request is let through
+BREAKER_FAILURES = int(os.environ.get('JJAI_BREAKER_FAILURES', 5))
+BREAKER_COOLDOWN = float(os.environ.get('JJAI_BREAKER_COOLDOWN', 60))
+
+
+_token_wait = contextvars.ContextVar('token_wait', default=TOKEN_WAIT_SECONDS)
+
+
+# Upstream calls made inside the block (and in pools given its context) wait
+# up to `seconds` for a token
+@contextmanager
+def bulk(seconds=BULK_TOKEN_WAIT_SECONDS):
+    token = _token_wait.set(seconds)
+    try:
+        yield
+    finally:
+        _token_wait.reset(token)
+
+
+def token_wait():
+    return _token_wait.get()
+
+
+# Raised instead of calling upstream while it is throttled or failing
+class UpstreamUnavailable(Exception):
+    pass
+
+
+def is_rate_limited(error):
+    text = str(error)
+    return type(error).__name__ == 'YFRateLimitError' or '429' in text or 'Too Many Requests' in text
+
+
+# Errors that say something about Yahoo rather than about the request (an
+# unknown ticker or a missing expiration must not open the breaker)
+def is_upstream_error(error):
+    if is_rate_limited(error) or isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    module = type(error).__module__ or ''
+    return module.startswith(('requests', 'urllib3', 'curl_cffi'))
+
+
+class TokenBucket:
+    def __init__(self, rate=UPSTREAM_RATE, burst=UPSTREAM_BURST):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    # Take a token, waiting up to `timeout` seconds for one; False if none came
+    def acquire(self, timeout=TOKEN_WAIT_SECONDS):
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+# Closed: calls go through. Open after BREAKER_FAILURES failures in a row:
+# calls fail fast. Half-open once the cooldown is over: a single trial call
+# decides whether it closes again or stays open for another cooldown.
+class CircuitBreaker:
+    def __init__(self, failures=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.consecutive = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        return 'half-open' if time.monotonic() - self.opened_at >= self.cooldown else 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.consecutive = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive += 1
+            if self._trial or self.consecutive >= self.failures:
+                if self.opened_at is None or self._trial:
+                    print(f"Upstream failing, circuit open for {self.cooldown:.0f}s")
+                self.opened_at = time.monotonic()
+            self._trial = False
+
+    # The trial call ended without saying anything about upstream
+    def release_trial(self):
+        with self._lock:
+            self._trial = False
+
+
+# Every upstream call asks the breaker, then the token bucket
+class Governor:
+    def __init__(self, bucket=None, breaker=None):
+        self.bucket = bucket or TokenBucket()
+        self.breaker = breaker or CircuitBreaker()
+
+    def admit(self):
+        if not self.breaker.allow():
+            raise UpstreamUnavailable("upstream circuit open")
+        if not self.bucket.acquire(token_wait()):
+            # Not a failure of upstream: give the trial slot back if this was it
+            self.breaker.release_trial()
+            raise UpstreamUnavailable("upstream rate budget exhausted")
+
+    def record(self, error=None):
+        if error is None:
+            self.breaker.record_success()
+        elif is_upstream_error(error):
+            self.breaker.record_failure()
+        else:
+            self.breaker.release_trial()
+        set_gauge('jjai_upstream_circuit_open', int(self.breaker.opened_at is not None))
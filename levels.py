@@ -0,0 +1,109 @@
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+# Key option levels of one underlying. Per-strike arrays are aligned with `strikes`.
+Levels = namedtuple('Levels', [
+    'spot',
+    'max_pain',
+    'put_call_oi_ratio',
+    'put_call_volume_ratio',
+    'call_wall',
+    'put_wall',
+    'strikes',
+    'call_oi',
+    'put_oi',
+    'net_gamma',
+    'expirations',
+])
+
+CONTRACT_SIZE = 100
+SECONDS_PER_YEAR = 365 * 24 * 3600
+
+# Options stop trading at 16:00 New York time on the expiration date
+EXPIRY_HOUR = 16
+
+# Floor for time to expiry, so same-day contracts don't divide by zero
+MIN_YEARS = 1 / (365 * 24)
+
+
+def years_to_expiry(expiration, now=None):
+    now = pd.Timestamp.now(tz='US/Eastern') if now is None else pd.Timestamp(now)
+    if now.tzinfo is not None:
+        now = now.tz_convert('US/Eastern').tz_localize(None)
+    expiry = pd.Timestamp(expiration) + pd.Timedelta(hours=EXPIRY_HOUR)
+    return max((expiry - now).total_seconds() / SECONDS_PER_YEAR, MIN_YEARS)
+
+
+# Black-Scholes gamma, vectorized; contracts without an implied vol get 0
+def bs_gamma(spot, strike, iv, years, rate=0.0):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vol_time = iv * np.sqrt(years)
+        d1 = (np.log(spot / strike) + (rate + 0.5 * iv * iv) * years) / vol_time
+        gamma = np.exp(-0.5 * d1 * d1) / (np.sqrt(2 * np.pi) * spot * vol_time)
+    return np.where(np.isfinite(gamma) & (iv > 0), gamma, 0.0)
+
+
+# Compute every level in one pass over one or more ChainSnapshots (e.g. all
+# expirations of an underlying). Gamma exposure is dealer-signed (long calls,
+# short puts) in dollars per 1% move of the underlying.
+def compute_levels(snapshots, spot, now=None, rate=0.0):
+    if not isinstance(snapshots, (list, tuple)):
+        snapshots = [snapshots]
+
+    strike = np.concatenate([s.columns['strike'] for s in snapshots])
+    oi = np.nan_to_num(np.concatenate([s.columns['openInterest'] for s in snapshots], dtype=float))
+    volume = np.nan_to_num(np.concatenate([s.columns['volume'] for s in snapshots], dtype=float))
+    iv = np.nan_to_num(np.concatenate([s.columns['impliedVolatility'] for s in snapshots], dtype=float))
+    is_call = np.concatenate([s.is_call for s in snapshots])
+    years = np.concatenate([
+        np.full(len(s), years_to_expiry(s.expiration, now)) for s in snapshots
+    ])
+
+    strikes, position = np.unique(strike, return_inverse=True)
+    size = len(strikes)
+    call_oi = np.bincount(position, weights=np.where(is_call, oi, 0.0), minlength=size)
+    put_oi = np.bincount(position, weights=np.where(is_call, 0.0, oi), minlength=size)
+
+    gamma = bs_gamma(spot, strike, iv, years, rate)
+    exposure = gamma * oi * CONTRACT_SIZE * spot * spot * 0.01
+    net_gamma = np.bincount(position, weights=np.where(is_call, exposure, -exposure), minlength=size)
+
+    call_volume = volume[is_call].sum()
+    put_volume = volume[~is_call].sum()
+
+    return Levels(
+        spot=spot,
+        max_pain=_max_pain(strikes, call_oi, put_oi),
+        put_call_oi_ratio=_ratio(put_oi.sum(), call_oi.sum()),
+        put_call_volume_ratio=_ratio(put_volume, call_volume),
+        call_wall=strikes[np.argmax(call_oi)] if size else None,
+        put_wall=strikes[np.argmax(put_oi)] if size else None,
+        strikes=strikes,
+        call_oi=call_oi,
+        put_oi=put_oi,
+        net_gamma=net_gamma,
+        expirations=[s.expiration for s in snapshots],
+    )
+
+
+# Settlement price (among listed strikes) at which option holders collect the
+# least. With strikes sorted, the payout at every strike comes from prefix sums:
+#   calls: sum over k < P of oi * (P - k);  puts: sum over k > P of oi * (k - P)
+def _max_pain(strikes, call_oi, put_oi):
+    if len(strikes) == 0:
+        return None
+    call_oi_below = np.cumsum(call_oi) - call_oi
+    call_value_below = np.cumsum(call_oi * strikes) - call_oi * strikes
+    put_oi_above = put_oi[::-1].cumsum()[::-1] - put_oi
+    put_value_above = (put_oi * strikes)[::-1].cumsum()[::-1] - put_oi * strikes
+    payout = (
+        strikes * call_oi_below - call_value_below
+        + put_value_above - strikes * put_oi_above
+    )
+    return strikes[np.argmin(payout)]
+
+
+def _ratio(numerator, denominator):
+    return float(numerator / denominator) if denominator else None
@@ -0,0 +1,136 @@
+import os
+import time
+import pstats
+import cProfile
+import threading
+import functools
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Profile requests slower than this many milliseconds (0 disables profiling)
+PROFILE_SLOW_MS = float(os.environ.get('JJAI_PROFILE_SLOW_MS', 0))
+PROFILE_DIR = os.environ.get('JJAI_PROFILE_DIR', 'profiles')
+
+_lock = threading.Lock()
+_histograms = {}
+_gauges = {}
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        self.total += 1
+        self.sum += seconds
+
+
+def observe(stage, seconds):
+    with _lock:
+        histogram = _histograms.get(stage)
+        if histogram is None:
+            histogram = _histograms[stage] = Histogram()
+        histogram.observe(seconds)
+
+
+def set_gauge(name, value, **labels):
+    with _lock:
+        _gauges[(name, tuple(sorted(labels.items())))] = value
+
+
+# Time a block of code under a stage name, e.g. with span('fetch_data.history')
+@contextmanager
+def span(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - started)
+
+
+# Decorator timing every call of a function; with profile=True, calls slower
+# than JJAI_PROFILE_SLOW_MS also get their cProfile stats written to PROFILE_DIR
+def timed(stage, profile=False):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            profiler = cProfile.Profile() if profile and PROFILE_SLOW_MS > 0 else None
+            started = time.perf_counter()
+            if profiler is not None:
+                try:
+                    profiler.enable()
+                except ValueError:  # another request on this process is being profiled
+                    profiler = None
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+                elapsed = time.perf_counter() - started
+                observe(stage, elapsed)
+                if profiler is not None and elapsed * 1000 >= PROFILE_SLOW_MS:
+                    _dump_profile(profiler, stage, elapsed)
+        return wrapper
+    return decorator
+
+
+def _dump_profile(profiler, stage, elapsed):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    name = f"{stage}-{time.strftime('%Y%m%d-%H%M%S')}-{int(elapsed * 1000)}ms-{os.getpid()}.prof"
+    path = os.path.join(PROFILE_DIR, name)
+    pstats.Stats(profiler).dump_stats(path)
+    print(f"Slow {stage} ({elapsed * 1000:.0f} ms), profile written to {path}")
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def _labels(pairs):
+    return ','.join(f'{key}="{_escape(value)}"' for key, value in pairs)
+
+
+# Prometheus text exposition of every stage histogram and gauge of this
+# process; extra_gauges and extra_counters are lists of (name, labels dict, value).
+# Series are labelled with the pid, except those named in `shared`: host-wide
+# values every worker reports alike, which would add up across pids
+def render(extra_gauges=(), extra_counters=(), shared=()):
+    with _lock:
+        histograms = {stage: (list(h.counts), h.total, h.sum) for stage, h in _histograms.items()}
+        gauges = dict(_gauges)
+    for name, labels, value in extra_gauges:
+        gauges[(name, tuple(sorted(labels.items())))] = value
+
+    pid = ('pid', os.getpid())
+    lines = [
+        '# HELP jjai_stage_seconds Time spent per request stage.',
+        '# TYPE jjai_stage_seconds histogram',
+    ]
+    for stage, (counts, total, seconds) in sorted(histograms.items()):
+        labels = _labels([('stage', stage), pid])
+        cumulative = 0
+        for bound, count in zip(BUCKETS, counts):
+            cumulative += count
+            lines.append(f'jjai_stage_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'jjai_stage_seconds_bucket{{{labels},le="+Inf"}} {total}')
+        lines.append(f'jjai_stage_seconds_sum{{{labels}}} {seconds}')
+        lines.append(f'jjai_stage_seconds_count{{{labels}}} {total}')
+
+    counters = {(name, tuple(sorted(labels.items()))): value for name, labels, value in extra_counters}
+    typed = set()
+    for kind, samples in (('gauge', gauges), ('counter', counters)):
+        for (name, labels), value in sorted(samples.items()):
+            if name not in typed:
+                lines.append(f'# TYPE {name} {kind}')
+                typed.add(name)
+            labels = _labels(list(labels) + ([] if name in shared else [pid]))
+            lines.append(f'{name}{{{labels}}} {value}' if labels else f'{name} {value}')
+    return '\n'.join(lines) + '\n'
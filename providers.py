@@ -0,0 +1,318 @@
+import os
+import json
+import threading
+import contextvars
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import yfinance as yf
+
+from archive import make_archive
+from bars import BarStore, PartialHistory
+from cache import TTLS, make_cache, make_key
+from chains import ChainSnapshot
+from governor import Governor
+from metrics import span
+
+# Yahoo requests in flight at once per process. Web threads beyond this wait
+# for a slot (timed as upstream.queue) instead of opening more connections.
+UPSTREAM_CONCURRENCY = int(os.environ.get('JJAI_UPSTREAM_CONCURRENCY', 8))
+
+
+# Base interface for market data sources used by the dashboard
+class MarketDataProvider:
+    def history(self, ticker, start, end, interval='5m'):
+        raise NotImplementedError
+
+    # History of several tickers over the same window, as {ticker: bars};
+    # PartialHistory when some of them failed. on_bars(ticker, bars) is
+    # called as soon as each ticker's bars are in.
+    def history_many(self, tickers, start, end, interval='5m', on_bars=None):
+        bars, errors = {}, {}
+        for ticker in tickers:
+            try:
+                bars[ticker] = self.history(ticker, start, end, interval)
+                if on_bars is not None:
+                    on_bars(ticker, bars[ticker])
+            except Exception as e:
+                errors[ticker] = e
+        if errors:
+            raise PartialHistory(bars, errors)
+        return bars
+
+    # Bars stored for a ticker however old, without asking upstream; None
+    # when nothing is stored
+    def stored_history(self, ticker, start, end, interval='5m'):
+        return None
+
+    # Returns a chains.ChainSnapshot holding both calls and puts
+    def option_chain(self, ticker, expiration_date):
+        raise NotImplementedError
+
+    def expirations(self, ticker):
+        raise NotImplementedError
+
+    # Whether any data of this ticker was last served past its TTL
+    def is_stale(self, ticker, expirations=(), interval=None):
+        return False
+
+
+# Live data straight from Yahoo Finance, paced by the governor's token bucket
+# and cut off by its circuit breaker while Yahoo keeps failing
+class YFinanceProvider(MarketDataProvider):
+    def __init__(self, concurrency=UPSTREAM_CONCURRENCY, governor=None):
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='upstream')
+        self.governor = governor or Governor()
+
+    @contextmanager
+    def _upstream(self, call):
+        with span('upstream.queue'):
+            self.governor.admit()
+            self._slots.acquire()
+        try:
+            with span(f"upstream.{call}"):
+                yield
+        except Exception as e:
+            self.governor.record(e)
+            raise
+        else:
+            self.governor.record()
+        finally:
+            self._slots.release()
+
+    def history(self, ticker, start, end, interval='5m'):
+        with self._upstream('history'):
+            bars = yf.Ticker(ticker).history(start=start, end=end, interval=interval)
+            # Rows without a single price are a failed download, not a quiet window
+            if not bars.empty and bars['Close'].isna().all():
+                raise ValueError(f"No prices for {ticker} from Yahoo")
+        return bars
+
+    # Yahoo serves one symbol per request, so the batch fans out in parallel,
+    # each request paying its own token and slot and reporting to the breaker
+    def history_many(self, tickers, start, end, interval='5m', on_bars=None):
+        def fetch(ticker):
+            bars = self.history(ticker, start, end, interval)
+            if on_bars is not None:
+                on_bars(ticker, bars)
+            return bars
+
+        context = contextvars.copy_context()
+        futures = {ticker: self._pool.submit(context.copy().run, fetch, ticker) for ticker in tickers}
+        bars, errors = {}, {}
+        for ticker, future in futures.items():
+            try:
+                bars[ticker] = future.result()
+            except Exception as e:
+                errors[ticker] = e
+        if errors:
+            raise PartialHistory(bars, errors)
+        return bars
+
+    def option_chain(self, ticker, expiration_date):
+        with self._upstream('option_chain'):
+            chain = yf.Ticker(ticker).option_chain(expiration_date)
+        return ChainSnapshot.from_frames(chain.calls, chain.puts, expiration_date)
+
+    def expirations(self, ticker):
+        with self._upstream('expirations'):
+            return list(yf.Ticker(ticker).options)
+
+
+# Fixture files are Parquet when a Parquet engine is installed, JSON otherwise
+def _parquet_available():
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _write_frame(base_path, df):
+    os.makedirs(os.path.dirname(base_path), exist_ok=True)
+    if _parquet_available():
+        df.to_parquet(base_path + '.parquet')
+    else:
+        df.to_json(base_path + '.json', orient='table', date_format='iso')
+
+
+def _read_frame(base_path):
+    if os.path.exists(base_path + '.parquet'):
+        return pd.read_parquet(base_path + '.parquet')
+    if os.path.exists(base_path + '.json'):
+        return pd.read_json(base_path + '.json', orient='table')
+    return None
+
+
+# History fixtures are keyed by the window length in days rather than by
+# absolute dates, so a recording keeps replaying for "last N days" requests
+def _span_days(start, end):
+    span = pd.Timestamp(end) - pd.Timestamp(start)
+    return max(1, int(round(span.total_seconds() / 86400)))
+
+
+def _history_path(root, ticker, start, end, interval):
+    return os.path.join(root, 'history', ticker.upper(), f"{interval}_{_span_days(start, end)}d")
+
+
+def _chain_path(root, ticker, expiration_date, side):
+    return os.path.join(root, 'chains', ticker.upper(), f"{expiration_date}_{side}")
+
+
+def _expirations_path(root, ticker):
+    return os.path.join(root, 'expirations', f"{ticker.upper()}.json")
+
+
+# Serves previously recorded fixtures, never touches the network
+class ReplayProvider(MarketDataProvider):
+    def __init__(self, root):
+        self.root = root
+
+    def history(self, ticker, start, end, interval='5m'):
+        data = _read_frame(_history_path(self.root, ticker, start, end, interval))
+        if data is None:
+            return pd.DataFrame(columns=['Open', 'High', 'Low', 'Close', 'Volume'])
+        return data
+
+    def option_chain(self, ticker, expiration_date):
+        calls = _read_frame(_chain_path(self.root, ticker, expiration_date, 'calls'))
+        puts = _read_frame(_chain_path(self.root, ticker, expiration_date, 'puts'))
+        if calls is None or puts is None:
+            raise ValueError(f"No recorded option chain for {ticker} expiring {expiration_date}")
+        return ChainSnapshot.from_frames(calls, puts, expiration_date)
+
+    def expirations(self, ticker):
+        path = _expirations_path(self.root, ticker)
+        if not os.path.exists(path):
+            return []
+        with open(path) as f:
+            return json.load(f)
+
+
+# Passes calls through to another provider and records every response
+class RecordingProvider(MarketDataProvider):
+    def __init__(self, inner, root):
+        self.inner = inner
+        self.root = root
+
+    def history(self, ticker, start, end, interval='5m'):
+        data = self.inner.history(ticker, start, end, interval)
+        _write_frame(_history_path(self.root, ticker, start, end, interval), data)
+        return data
+
+    # Recorded per ticker, so a replay serves the batch from single-ticker files
+    def history_many(self, tickers, start, end, interval='5m', on_bars=None):
+        frames = {}
+        try:
+            frames = self.inner.history_many(tickers, start, end, interval, on_bars)
+        except PartialHistory as e:
+            frames = e.bars
+            raise
+        finally:
+            for ticker, data in frames.items():
+                _write_frame(_history_path(self.root, ticker, start, end, interval), data)
+        return frames
+
+    def option_chain(self, ticker, expiration_date):
+        chain = self.inner.option_chain(ticker, expiration_date)
+        _write_frame(_chain_path(self.root, ticker, expiration_date, 'calls'), chain.calls)
+        _write_frame(_chain_path(self.root, ticker, expiration_date, 'puts'), chain.puts)
+        return chain
+
+    def expirations(self, ticker):
+        dates = self.inner.expirations(ticker)
+        path = _expirations_path(self.root, ticker)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(dates, f)
+        return dates
+
+
+# Serves responses from a SharedCache, falling back to another provider on a miss.
+# History goes through a BarStore, so only bars newer than the cached ones are
+# downloaded, and below it through the bar archive when one is given.
+# refresh=True skips the lookup and overwrites the entry, which is how the
+# prefetch scheduler keeps it warm.
+class CachedProvider(MarketDataProvider):
+    def __init__(self, inner, cache, archive=None):
+        self.inner = inner
+        self.cache = cache
+        self.bars = BarStore(archive or inner, cache)
+
+    @staticmethod
+    def history_key(ticker, interval):
+        return BarStore.key(ticker, interval)
+
+    @staticmethod
+    def chain_key(ticker, expiration_date):
+        return make_key(ticker.upper(), expiration_date)
+
+    # Load through the cache; when loading fails, serve the last good value
+    # (stale-while-revalidate: the next request past the TTL tries again)
+    def _fetch(self, kind, key, loader, ttl, refresh):
+        try:
+            return self.cache.get_or_load(kind, key, loader, ttl, refresh)
+        except Exception as e:
+            stale = None if refresh else self.cache.get_stale(kind, key)
+            if stale is None:
+                raise
+            print(f"Serving stale {kind} {key}: {e}")
+            return stale
+
+    def is_stale(self, ticker, expirations=(), interval=None):
+        entries = [('chain', self.chain_key(ticker, e)) for e in expirations]
+        if interval is not None:
+            entries.append(('bars', self.history_key(ticker, interval)))
+        for kind, key in entries:
+            remaining = self.cache.expires_in(kind, key)
+            if remaining is not None and remaining < 0:
+                return True
+        return False
+
+    def history(self, ticker, start, end, interval='5m', refresh=False):
+        return self.bars.history(ticker, start, end, interval, refresh)
+
+    def history_many(self, tickers, start, end, interval='5m', refresh=False):
+        return self.bars.history_many(tickers, start, end, interval, refresh)
+
+    def stored_history(self, ticker, start, end, interval='5m'):
+        return self.bars.stored(ticker, start, end, interval)
+
+    def option_chain(self, ticker, expiration_date, refresh=False):
+        return self._fetch(
+            'chain', self.chain_key(ticker, expiration_date),
+            lambda: self.inner.option_chain(ticker, expiration_date),
+            TTLS['chain'],
+            refresh,
+        )
+
+    def expirations(self, ticker, refresh=False):
+        return self._fetch(
+            'expirations', ticker.upper(),
+            lambda: self.inner.expirations(ticker),
+            TTLS['expirations'],
+            refresh,
+        )
+
+
+# Build the provider selected by JJAI_DATA_PROVIDER (yfinance, record or replay),
+# behind the shared cache unless JJAI_CACHE=0. Live Yahoo history also goes
+# through the on-disk bar archive; recordings and replays keep their own
+# fixture windows.
+def make_provider(kind=None, fixtures=None, cache=None):
+    kind = kind or os.environ.get('JJAI_DATA_PROVIDER', 'yfinance')
+    fixtures = fixtures or os.environ.get('JJAI_FIXTURES', 'fixtures')
+    if kind == 'yfinance':
+        source = YFinanceProvider()
+    elif kind == 'record':
+        source = RecordingProvider(YFinanceProvider(), fixtures)
+    elif kind == 'replay':
+        source = ReplayProvider(fixtures)
+    else:
+        raise ValueError(f"Unknown data provider: {kind}")
+    if cache is None and os.environ.get('JJAI_CACHE', '1') == '0':
+        return source
+    archive = make_archive(source) if kind == 'yfinance' else None
+    return CachedProvider(source, cache or make_cache(), archive)
@@ -0,0 +1,88 @@
+import os
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from governor import bulk
+
+# Tickers scanned at the same time
+SCAN_WORKERS = int(os.environ.get('JJAI_SCAN_WORKERS', 8))
+
+# How long a finished scan stays readable in the shared cache
+SCAN_TTL = 3600
+
+
+def parse_tickers(text):
+    tickers = [t.strip().upper() for t in text.replace('\n', ',').replace(' ', ',').split(',')]
+    return list(dict.fromkeys(t for t in tickers if t))
+
+
+# Runs scan_fn(ticker) -> row over a ticker universe on a worker pool and
+# yields each row as soon as it is ready. Its upstream calls queue for the
+# rate budget rather than fail when a large universe outruns it.
+def run_scan(scan_fn, tickers, workers=SCAN_WORKERS):
+    def queued(ticker):
+        with bulk():
+            return scan_fn(ticker)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='scan') as pool:
+        futures = {pool.submit(queued, ticker): ticker for ticker in tickers}
+        for future in as_completed(futures):
+            ticker = futures[future]
+            try:
+                yield ticker, future.result(), None
+            except Exception as e:
+                yield ticker, None, str(e)
+
+
+def throughput(done, started):
+    elapsed = time.time() - started
+    return done / elapsed if elapsed > 0 else 0.0
+
+
+# A scan running in the background. Progress is written to the shared cache
+# after every ticker, so any worker can serve the page polling for it.
+class ScanJob:
+    def __init__(self, scan_fn, tickers, cache, workers=SCAN_WORKERS):
+        self.id = uuid.uuid4().hex
+        self.scan_fn = scan_fn
+        self.tickers = tickers
+        self.cache = cache
+        self.workers = workers
+        self.state = {
+            'total': len(tickers),
+            'rows': [],
+            'errors': {},
+            'started': time.time(),
+            'finished': None,
+            'tickers_per_second': 0.0,
+        }
+
+    def start(self):
+        self._save()
+        threading.Thread(target=self._run, name=f"scan-{self.id}", daemon=True).start()
+        return self
+
+    def _run(self):
+        for ticker, row, error in run_scan(self.scan_fn, self.tickers, self.workers):
+            if error is None:
+                self.state['rows'].append(row)
+            else:
+                self.state['errors'][ticker] = error
+            self._update_rate()
+            self._save()
+        self.state['finished'] = time.time()
+        self._update_rate()
+        self._save()
+
+    def _update_rate(self):
+        done = len(self.state['rows']) + len(self.state['errors'])
+        self.state['tickers_per_second'] = throughput(done, self.state['started'])
+
+    def _save(self):
+        self.cache.set('scan', self.id, self.state, SCAN_TTL)
+
+
+def scan_progress(cache, job_id):
+    return cache.get('scan', job_id)
@@ -0,0 +1,148 @@
+import os
+import threading
+from datetime import datetime, timedelta
+
+import pytz
+
+from bars import PartialHistory
+from cache import private_file
+from governor import UpstreamUnavailable, bulk, is_rate_limited
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-worker election, every process prefetches
+    fcntl = None
+
+EASTERN = pytz.timezone('US/Eastern')
+
+# Seconds between refresh passes for each market session
+SESSION_PERIODS = {
+    'regular': 60,
+    'extended': 300,
+    'closed': 1800,
+}
+
+# Widest (interval, days) history window the dashboard asks for per interval;
+# the bar store serves every narrower window from it
+HISTORY_WINDOWS = [('1h', 1), ('5m', 28)]
+
+BACKOFF_START = 30
+BACKOFF_MAX = 900
+
+
+def market_session(now=None):
+    now = (now or datetime.now(EASTERN)).astimezone(EASTERN)
+    if now.weekday() >= 5:
+        return 'closed'
+    minutes = now.hour * 60 + now.minute
+    if 9 * 60 + 30 <= minutes < 16 * 60:
+        return 'regular'
+    if 4 * 60 <= minutes < 20 * 60:
+        return 'extended'
+    return 'closed'
+
+
+# Keeps the history and nearest option chains of a watchlist warm in the
+# shared cache. Only one worker per host runs the refresh loop (elected with
+# a lock file next to the cache); the others stand by in case it exits.
+# Refreshes go through the cache's single-flight, so one racing a foreground
+# fetch of the same entry shares its upstream call.
+class PrefetchScheduler:
+    def __init__(self, provider, tickers, expirations_per_ticker=2, lock_path=None):
+        self.provider = provider
+        self.tickers = [t.upper() for t in tickers]
+        self.expirations_per_ticker = expirations_per_ticker
+        self.lock_path = lock_path or provider.cache.path + '.prefetch.lock'
+        self.backoff = 0
+        self._lock_file = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='prefetch', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _is_leader(self):
+        if fcntl is None or self._lock_file is not None:
+            return True
+        private_file(self.lock_path)
+        lock_file = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            period = SESSION_PERIODS[market_session()]
+            if self._is_leader():
+                with bulk():
+                    self.refresh_all(period)
+            self._stop.wait(max(period, self.backoff))
+
+    # Refresh every watchlist entry that would expire before the next pass
+    def refresh_all(self, period):
+        try:
+            self.refresh_bars(period)
+        except Exception as e:
+            if self._throttled(e):
+                return
+            print(f"Prefetch failed for bars: {e}")
+        for ticker in self.tickers:
+            if self._stop.is_set():
+                return
+            try:
+                self.refresh_ticker(ticker, period)
+            except Exception as e:
+                if self._throttled(e):
+                    return
+                print(f"Prefetch failed for {ticker}: {e}")
+        self.backoff = 0
+
+    def _throttled(self, error):
+        errors = error.errors.values() if isinstance(error, PartialHistory) else [error]
+        if not any(is_rate_limited(e) or isinstance(e, UpstreamUnavailable) for e in errors):
+            return False
+        self.backoff = min(BACKOFF_MAX, max(BACKOFF_START, self.backoff * 2))
+        print(f"Prefetch rate-limited, backing off {self.backoff}s")
+        return True
+
+    # Bars of every due ticker, one coalesced fan-out per interval
+    def refresh_bars(self, period):
+        end = datetime.now(EASTERN)
+        for interval, days in HISTORY_WINDOWS:
+            start = end - timedelta(days=days)
+            due = [t for t in self.tickers if self._needs_refresh('bars', self.provider.history_key(t, interval), period)]
+            if due:
+                self.provider.history_many(due, start, end, interval, refresh=True)
+
+    def refresh_ticker(self, ticker, period):
+        if self._needs_refresh('expirations', ticker, period):
+            self.provider.expirations(ticker, refresh=True)
+        for expiration_date in self.provider.expirations(ticker)[:self.expirations_per_ticker]:
+            key = self.provider.chain_key(ticker, expiration_date)
+            if self._needs_refresh('chain', key, period):
+                self.provider.option_chain(ticker, expiration_date, refresh=True)
+
+    def _needs_refresh(self, kind, key, period):
+        remaining = self.provider.cache.expires_in(kind, key)
+        return remaining is None or remaining <= period
+
+# Tickers to keep warm: JJAI_WATCHLIST (comma separated) on top of the defaults
+def watchlist(defaults):
+    extra = [t.strip().upper() for t in os.environ.get('JJAI_WATCHLIST', '').split(',') if t.strip()]
+    return list(dict.fromkeys(list(defaults) + extra))
+
+
+# Start prefetching unless JJAI_PREFETCH=0 or the provider has no shared cache
+def start_prefetch(provider, tickers):
+    if os.environ.get('JJAI_PREFETCH', '1') == '0' or not hasattr(provider, 'cache'):
+        return None
+    expirations = int(os.environ.get('JJAI_WATCHLIST_EXPIRATIONS', 2))
+    return PrefetchScheduler(provider, tickers, expirations).start()